@@ -0,0 +1,328 @@
+import io
+import os
+import sys
+import json
+import time
+import re
+import random
+import shutil
+import tarfile
+import tempfile
+import subprocess
+from pathlib import Path
+from collections import defaultdict
+from contextlib import contextmanager
+import click
+import pandas as pd
+import main as evaluator
+
+
+# the final exam of exams.json, so that the generated tree can also be run end-to-end
+EXAM = evaluator.load_exam(evaluator.EXAMS_CONFIG, "final")
+EXAM_NAME = EXAM['name']
+ORIGQIDDICT = EXAM['origqiddict']
+GENERATED_MARKER = ".benchmark"
+VARIANTS = (('question1369', 'question1370', 'question1371', 'question1372'),
+            ('question1373', 'question1374', 'question1375', 'question1372'))
+
+TEMPLATE_ABOVE = """import sys
+
+
+def read_numbers():
+    return [int(x) for x in sys.stdin.readline().split()]
+
+
+numbers = read_numbers()
+result = 0
+# DO_NOT_EDIT_ANYTHING_ABOVE_THIS_LINE
+"""
+TEMPLATE_BELOW = """# DO_NOT_EDIT_ANYTHING_BELOW_THIS_LINE
+print(result)
+"""
+
+CLEAN_SNIPPETS = [
+    "total = 0\nfor number in numbers:\n    total += number\nresult = total",
+    "result = max(numbers) - min(numbers)",
+    "evens = [number for number in numbers if number % 2 == 0]\nresult = len(evens)",
+    "count = 0\nindex = 0\nwhile index < len(numbers):\n    if numbers[index] > 0:\n        count += 1\n    index += 1\nresult = count",
+    "def square(value):\n    return value * value\n\n\nresult = sum(square(number) for number in numbers)",
+    "best = numbers[0]\nfor number in numbers[1:]:\n    if number > best:\n        best = number\nresult = best",
+    "seen = set()\nfor number in numbers:\n    seen.add(number)\nresult = len(seen)",
+    "pairs = 0\nfor i in range(len(numbers)):\n    for j in range(i + 1, len(numbers)):\n        if numbers[i] + numbers[j] == 0:\n            pairs += 1\nresult = pairs",
+    "text = ' '.join(str(number) for number in numbers)\nresult = len(text)",
+    "# keep a running product\nproduct = 1\nfor number in numbers:\n    product *= number\nresult = product",
+    ]
+BUGS = [
+    ("for number in numbers:", "for number in numbers[1:]:"),
+    ("range(len(numbers))", "range(len(numbers) - 1)"),
+    ("result = total", "result = total + 1"),
+    ("> best", ">= best + 1"),
+    ("index += 1", "index += 2"),
+    ]
+NAMES = {
+    'total': ['total', 'acc', 'summed', 'running'],
+    'number': ['number', 'n', 'num', 'value', 'item'],
+    'count': ['count', 'cnt', 'hits', 'positives'],
+    'index': ['index', 'idx', 'pos', 'k'],
+    'best': ['best', 'largest', 'top', 'maximum'],
+    'seen': ['seen', 'unique', 'distinct', 'values'],
+    'pairs': ['pairs', 'matches', 'zeros', 'found'],
+    'product': ['product', 'prod', 'mul', 'res'],
+    }
+# deceptively succinct corrections the detectors are there to catch
+TRICKS = [
+    "if result > 0: result -= 1",
+    "a = 1; b = 2",
+    "result, spare = result, 0",
+    "exec('result = result')",
+    "a = b = 0",
+    "global numbers",
+    "result = result if result else 0",
+    "result = result",
+    "def label():\n    return ''",
+    "if result and 'x':\n    pass",
+    "result = result and 'x' or result",
+    "print('')",
+    "for number in numbers:\n    continue",
+    "result = result + \\\n    0",
+    "result == 0",
+    "unused = len(numbers)",
+    ]
+
+
+def make_user_code(rng):
+    code = "\n".join(rng.sample(CLEAN_SNIPPETS, rng.randint(1, 3)))
+    bugs = [bug for bug in BUGS if bug[0] in code]
+    if bugs and rng.random() < 0.7:
+        code = code.replace(*rng.choice(bugs), 1)
+    # every student names things their own way
+    for name, alternatives in NAMES.items():
+        code = re.sub(rf"\b{name}\b", rng.choice(alternatives), code)
+    return code
+
+
+def make_correction(rng, code, trickrate, attempts=10):
+    for _ in range(attempts):
+        lines = code.split("\n")
+        for _ in range(rng.randint(0, 3)):
+            edit = rng.random()
+            position = rng.randrange(len(lines) + 1)
+            if edit < 0.4:
+                lines[position:position] = rng.choice(CLEAN_SNIPPETS).split("\n")
+            elif edit < 0.7 and position < len(lines):
+                del lines[position]
+            elif position < len(lines):
+                lines[position] = lines[position].replace("numbers", "numbers[:]")
+        if rng.random() < trickrate:
+            position = rng.randrange(len(lines) + 1)
+            lines[position:position] = rng.choice(TRICKS).split("\n")
+        try:
+            compile("\n".join(lines), "<correction>", "exec")
+        except SyntaxError:
+            continue
+        return "\n".join(lines)
+    return code
+
+
+def make_source(usercode):
+    return TEMPLATE_ABOVE + usercode + "\n" + TEMPLATE_BELOW
+
+
+def write_tar(path, files):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(path, "w:gz") as tf:
+        for name, text in files.items():
+            data = text.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = 1670000000
+            tf.addfile(info, io.BytesIO(data))
+
+
+def write_gradebook(path, rows):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame([[path.stem]]).to_excel(writer, header=False, index=False)
+        pd.DataFrame(rows).to_excel(writer, startrow=1, index=False)
+
+
+def generated_coursehome(home):
+    # the course directory of exams.json with home in place of ~, or of the root of an absolute one
+    course = Path(json.loads(evaluator.EXAMS_CONFIG.read_text())['course'])
+    return home.joinpath(*course.parts[1:] if course.parts[0] == '~' or course.is_absolute() else course.parts)
+
+
+def generate_exam(home, students, seed=0, sectionsize=50, trickrate=0.3, copyrate=0.05):
+    rng = random.Random(seed)
+    coursehome = generated_coursehome(home)
+    examhome = coursehome / EXAM_NAME
+    # only a tree written by an earlier run is replaced, never a real exam with its manual patches or the course's student info
+    if not (examhome / GENERATED_MARKER).is_file() and (examhome.exists() or (coursehome / "studentinfo.xlsx").exists()):
+        print(f"{coursehome} already holds an exam that was not generated by the benchmark, refusing to overwrite it")
+        return None
+    shutil.rmtree(examhome, ignore_errors=True)
+    rawhome = examhome / "raw"
+
+    qids = list(ORIGQIDDICT) + [cqid for v in ORIGQIDDICT.values() for cqid in evaluator.enlist(v['corrid'])]
+    write_tar(rawhome / "questions" / "questions.tar.gz", {f"{qid}/src/Main.py": make_source("result = 0") for qid in qids})
+
+    users = [1000 + i for i in range(students)]
+    for section in range(1, (students - 1) // sectionsize + 2):
+        sectionusers = users[(section - 1) * sectionsize:section * sectionsize]
+        oqids = VARIANTS[section % len(VARIANTS)]
+        cqids = [cqid for oqid in oqids for cqid in evaluator.enlist(ORIGQIDDICT[oqid]['corrid'])]
+        originals, corrections, originalgrades, correctiongrades = {}, {}, [], []
+        shared = defaultdict(list)
+        for user in sectionusers:
+            grades = []
+            for oqid in oqids:
+                code = make_user_code(rng)
+                originals[f"sec_{section}/user{user}/{oqid}/src/Main.py"] = make_source(code)
+                originals[f"sec_{section}/user{user}/{oqid}/src/notes.txt"] = "not extracted"
+                grades.append(rng.choice([0, 20, 40, 60, 80, 100]))
+                for cqid in evaluator.enlist(ORIGQIDDICT[oqid]['corrid']):
+                    if rng.random() < 0.9:
+                        # some students hand in a classmate's correction instead of correcting their own original
+                        correction = rng.choice(shared[cqid]) if shared[cqid] and rng.random() < copyrate else make_correction(rng, code, trickrate)
+                        shared[cqid].append(correction)
+                        corrections[f"sec_{section}/user{user}/{cqid}/src/Main.py"] = make_source(correction)
+            originalgrades.append({'User ID': user, 'Question Id List': ", ".join(oqid[8:] for oqid in oqids)}
+                                  | {f'Total (Question {i + 1})': grade for i, grade in enumerate(grades)})
+            correctiongrades.append({'User ID': user, 'Question Id List': ", ".join(cqid[8:] for cqid in cqids)}
+                                    | {f'Total (Question {i + 1})': rng.choice([0, 100, 100, 100]) for i in range(len(cqids))})
+        write_tar(rawhome / "originals" / f"sec{section}.tar.gz", originals)
+        write_tar(rawhome / "corrections" / f"sec{section}" / "corrections.tar.gz", corrections)
+        write_gradebook(rawhome / "originals" / f"sec{section}.xlsx", originalgrades)
+        write_gradebook(rawhome / "corrections" / f"sec{section}" / "gradebook.xlsx", correctiongrades)
+
+    pd.DataFrame({'user': users, 'name': [f"Student {user}" for user in users], 'studentID': [2020400000 + user for user in users]}) \
+        .to_excel(coursehome / "studentinfo.xlsx", index=False)
+    (examhome / GENERATED_MARKER).write_text(f"{students} students, seed {seed}\n")
+    return examhome
+
+
+class Stages(list):
+    @contextmanager
+    def stage(self, name, items=1):
+        start = time.perf_counter()
+        yield
+        self.append({'stage': name, 'seconds': time.perf_counter() - start, 'items': items})
+
+
+def run_stages(examhome, lintengine):
+    stages = Stages()
+    processedhome = examhome / "processed"
+    patchhome = examhome / "patch"
+    rawhome = examhome / "raw"
+
+    tars = {kind: sorted((rawhome / kind).glob(pattern)) for kind, pattern in (("questions", "*.tar.gz"), ("originals", "*.tar.gz"), ("corrections", "*/*.tar.gz"))}
+    with stages.stage("extraction", sum(map(len, tars.values()))):
+        for kind, kindtars in tars.items():
+            evaluator.tarsextract(kindtars, processedhome / kind, examhome / "tarmanifests" / kind)
+
+    gradebooks = sorted(rawhome.glob("originals/*.xlsx")) + sorted(rawhome.glob("corrections/*/*.xlsx"))
+    with stages.stage("gradebooks", len(gradebooks)):
+        for gradebook in gradebooks:
+            evaluator.parse_gradebook(gradebook, 'org')
+
+    qpaths = sorted((processedhome / "questions").glob("*/src/Main.py"))
+    with stages.stage("whitelist", len(qpaths)):
+        vulturewldict = {qpath.parts[-3]: evaluator.prepare_vulture_whitelist(qpath) for qpath in qpaths}
+
+    pairs = []
+    for npopath in sorted((processedhome / "originals").glob("*/*/*/src/Main.py")):
+        stuid, oqid = npopath.parts[-4:-2]
+        for cqid in evaluator.enlist(ORIGQIDDICT[oqid]['corrid']):
+            npcpath = processedhome / "corrections" / npopath.parts[-5] / stuid / cqid / "src/Main.py"
+            if npcpath.is_file():
+                pairs.append((npopath.parts[-5].split('_')[1], stuid, oqid, npcpath, patchhome / "corrections" / stuid / cqid / "src/Main.py",
+                              npopath, patchhome / "originals" / stuid / oqid / "src/Main.py", True, vulturewldict[oqid], examhome, None, None,
+                              ORIGQIDDICT[oqid]['legitrange'][1]))
+    if lintengine != 'native':
+        evaluator.init_worker(lintengine)
+    with stages.stage("get_report", len(pairs)):
+        records = [evaluator.analyze_stuq(*arguments, lintengine=lintengine) for arguments in pairs]
+
+    with stages.stage("scoring", len(records)):
+        reportdf = evaluator.records_frame(records, evaluator.report_columns())
+        reportdf['ratio'] = evaluator.score_ratio(reportdf, ORIGQIDDICT, 'legitrange')
+
+    with stages.stage("copies", len(records)):
+        reportdf['cor-copies'] = evaluator.find_copies(reportdf, 0.8)
+        reportdf = reportdf.drop(columns=['org-minhash', 'cor-minhash'])
+
+    with stages.stage("inspect", len(records)):
+        for pf in ('org', 'cor'):
+            reportdf[f'{pf}-inspect'] = evaluator.get_flaws_column(reportdf, pf)
+        reportdf['all-inspect'] = evaluator.get_flaws_column(reportdf)
+        reportdf['edit_opcodes'] = evaluator.render_opcodes_column(reportdf, 1.0)
+
+    with stages.stage("excel", len(reportdf)):
+        evaluator.write_excel(examhome / f'report_corrections_{EXAM_NAME}.xlsx', reportdf, 1, 1)
+
+    return stages
+
+
+def run_end_to_end(home, arguments):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, str(Path(evaluator.__file__).resolve()), *arguments], cwd=home, env=os.environ | {'HOME': str(home)},
+                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def per_item(row):
+    return 1000 * row['seconds'] / max(row['items'], 1)
+
+
+def print_stages(stages, baseline):
+    print(f"{'stage':<12}{'seconds':>10}{'items':>8}{'ms/item':>10}" + (f"{'baseline':>10}{'change':>9}" if baseline else ""))
+    for row in stages:
+        line = f"{row['stage']:<12}{row['seconds']:>10.2f}{row['items']:>8}{per_item(row):>10.2f}"
+        if row['stage'] in baseline:
+            line += f"{baseline[row['stage']]:>10.2f}{100 * (per_item(row) / baseline[row['stage']] - 1):>+8.0f}%"
+        print(line)
+
+
+@click.command()
+@click.option('--students', default=200, show_default=True, help="Number of students in the generated exam.")
+@click.option('--seed', default=0, show_default=True, help="Seed of the generated exam.")
+@click.option('--section-size', default=50, show_default=True, help="Students per section; every section gets its own tarballs and gradebooks.")
+@click.option('--trick-rate', default=0.3, show_default=True, help="Share of the corrections that get a planted deceptive trick.")
+@click.option('--copy-rate', default=0.05, show_default=True, help="Share of the corrections that are copied from a classmate.")
+@click.option('--home', type=click.Path(file_okay=False, path_type=Path), help="Directory to generate the exam under (as if it were $HOME); a temporary one by default.")
+@click.option('--generate-only', is_flag=True, help="Only generate the exam tree and keep it.")
+@click.option('--pylint', 'lintengine', flag_value='pylint', default='native', help="Time the pylint checker instead of the built-in one.")
+@click.option('--end-to-end', is_flag=True, help="Also time a full run of main.py on the generated tree.")
+@click.option('--save', type=click.Path(dir_okay=False, path_type=Path), help="Write the timings to this JSON file.")
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False, path_type=Path), help="Compare the per-item timings against a JSON file written by --save.")
+def benchmark(students, seed, section_size, trick_rate, copy_rate, home, generate_only, lintengine, end_to_end, save, compare):
+    temporary = home is None
+    home = Path(tempfile.mkdtemp(prefix="soe-bench-")) if temporary else home.resolve()
+
+    stages = Stages()
+    with stages.stage("generate", students):
+        examhome = generate_exam(home, students, seed, section_size, trick_rate, copy_rate)
+    if examhome is None:
+        return
+    if generate_only:
+        print(f"Generated {students} students under {examhome}")
+        return
+
+    try:
+        stages += run_stages(examhome, lintengine)
+        if end_to_end:
+            for generated in ("processed", "patch", "tarmanifests", "gradebooks"):
+                shutil.rmtree(examhome / generated, ignore_errors=True)
+            stages.append({'stage': "end-to-end", 'seconds': run_end_to_end(home, ['--exam', EXAM_NAME, '--no-cache'] + (['--pylint'] if lintengine == 'pylint' else [])), 'items': students})
+    finally:
+        if temporary:
+            shutil.rmtree(home, ignore_errors=True)
+
+    baseline = {row['stage']: per_item(row) for row in json.loads(compare.read_text())['stages']} if compare else {}
+    print_stages(stages, baseline)
+    if save:
+        save.write_text(json.dumps({'students': students, 'seed': seed, 'lintengine': lintengine, 'stages': stages}, indent=1))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,59 +1,161 @@
 import re
 import os
+import ast
 import shutil
 import click
 import tarfile
 from pathvalidate import sanitize_filepath
 # import coverage
 import edit_distance
-from pylint.reporters.text import TextReporter
-from io import StringIO
+import difflib
+from io import StringIO, BytesIO, TextIOWrapper
 import tempfile
 import vulture
+import numpy as np
 import pandas as pd
 from itertools import chain, repeat
+from functools import partial, lru_cache
+from contextlib import nullcontext, contextmanager
+from collections import defaultdict
 import glob
-from pathlib import Path
-from contextlib import redirect_stderr
-from alive_progress import alive_it
+from pathlib import Path, PurePosixPath
+from alive_progress import alive_bar
 import tokenize
+import pkgutil
+import sqlite3
+import hashlib
+import zlib
+import json
+import math
+import time
 import mergedeep
 import warnings
 from multiprocessing import Pool, cpu_count
 import openpyxl
-from copy import copy
 
 
-def tarextract(tar, outdir):
+TAR_MEMBERS = ("src/Main.py", "src/grade.txt")
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(partial(f.read, 1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_tarmanifest(manifestpath):
+    return json.loads(manifestpath.read_text()) if manifestpath.is_file() else None
+
+
+def tarmanifest_current(manifest, archivehash, outdir, members=TAR_MEMBERS):
+    return bool(manifest) and manifest['archive'] == archivehash and manifest['filter'] == list(members) \
+        and all((outdir / member['path']).is_file() for member in manifest['members'])
+
+
+def tarextract(tar, outdir, manifestpath, members=TAR_MEMBERS):
+    archivehash = file_sha1(tar)
+    previous = read_tarmanifest(manifestpath)
+    if tarmanifest_current(previous, archivehash, outdir, members):
+        return False
+
+    entries = []
+    with tarfile.open(tar) as tf:
+        for file in tf:
+            name = PurePosixPath(sanitize_filepath(file.name, replacement_text="_"))
+            if not file.isfile() or not any(name.match(member) for member in members):
+                continue
+
+            data = tf.extractfile(file).read()
+            datahash = hashlib.sha1(data).hexdigest()
+            path = outdir / name
+            # unchanged members keep their mtime so incremental runs leave them alone
+            if not (path.is_file() and file_sha1(path) == datahash):
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(data)
+            entries.append({'name': file.name, 'size': file.size, 'sha1': datahash, 'path': name.as_posix()})
+
+    if previous:
+        extracted = {entry['path'] for entry in entries}
+        for member in previous['members']:
+            if member['path'] not in extracted:
+                (outdir / member['path']).unlink(missing_ok=True)
+
+    manifestpath.parent.mkdir(parents=True, exist_ok=True)
+    manifestpath.write_text(json.dumps({'archive': archivehash, 'filter': list(members), 'members': entries}, indent=1))
+    return True
+
+
+def tarread(tar, outdir, pattern):
+    depth = len(PurePosixPath(pattern).parts)
+    sourcedata = {}
     with tarfile.open(tar) as tf:
         for file in tf:
-            file.name = sanitize_filepath(file.name, replacement_text="_")
+            name = PurePosixPath(sanitize_filepath(file.name, replacement_text="_"))
+            if file.isfile() and len(name.parts) == depth and name.match(pattern):
+                sourcedata[outdir / name] = tf.extractfile(file).read()
+    return sourcedata
 
-        tf.extractall(outdir)
 
+def tarsread(tars, outdir, pattern):
+    arguments = list(zip(tars, repeat(outdir), repeat(pattern)))
+    if not arguments:
+        return {}
+
+    with Pool(min(cpu_count(), len(arguments))) as pool:
+        return {path: data for sourcedata in pool.starmap(tarread, arguments) for path, data in sourcedata.items()}
 
-def tarsextract(tars, outdir):
-    if outdir.is_dir():
-        if click.confirm(f"Directory '{outdir.relative_to(outdir.parents[3])}' already exists, want to delete it and extract new?", default=False):
-            shutil.rmtree(outdir)
-        else:
-            return
 
-    outdir.mkdir(parents=True)
+def tarmanifest_path(tar, manifestdir):
+    return manifestdir / f"{tar.parent.name}-{tar.name}.json"
+
+
+# the manifests are the checkpoint of the extraction, a processed tree on its own may be partial,
+# e.g. a --stream run only writes the files that got a patch copy
+def tarsextracted(tars, outdir, manifestdir, members=TAR_MEMBERS):
+    return all(tarmanifest_current(read_tarmanifest(tarmanifest_path(tar, manifestdir)), file_sha1(tar), outdir, members) for tar in tars)
+
+
+def tarsextract(tars, outdir, manifestdir, members=TAR_MEMBERS):
+    arguments = [(tar, outdir, tarmanifest_path(tar, manifestdir), members) for tar in tars]
+    if not arguments:
+        return
 
-    arguments = list(zip(tars, repeat(outdir)))
     with Pool(min(cpu_count(), len(arguments))) as pool:
-        pool.starmap(tarextract, arguments)
+        extracted = sum(pool.starmap(tarextract, arguments))
+    print(f"[{outdir.name}] extracted {extracted} of {len(arguments)} archives, {len(arguments) - extracted} unchanged")
+
+
+class TokenCache(dict):
+    def __missing__(self, line):
+        try:
+            tokens = list(tokenize.generate_tokens(StringIO(line).readline))
+        except tokenize.TokenError as e:
+            tokens = e
+        self[line] = tokens
+        return tokens
+
+
+def ends_with_backslash(parts):
+    return next((part.endswith('\\') for part in reversed(parts) if part), False)
+
 
+def sanitize_spans(code, codepath, full=False, tokencache=None):
+    if tokencache is None:
+        tokencache = TokenCache()
 
-def sanitize(code, codepath, full=False):
     resourceindicator = '/'.join(codepath.parts[-6:-2]) + (' (full)' if full else '')
+    # every joined line is tagged with the [start, end) range of source lines it came from, and
+    # the joins collect their pieces in lists so that long joined blocks are built in linear time
+    spans = []
 
     def join_triplequote_strings(code):
-        rline = ''
+        rline = []
+        start = 0
         inquotes = False
-        for line in code:
-            rline += line
+        for i, line in enumerate(code):
+            rline.append(line)
             qactivity = True
             while qactivity:
                 qactivity = False
@@ -71,32 +173,45 @@ def sanitize(code, codepath, full=False):
                         inquotes = q
                         qactivity = True
             if inquotes:
-                if not rline.endswith('\\'):
-                    rline += '\\n'
+                if not ends_with_backslash(rline):
+                    rline.append('\\n')
             else:
-                yield rline
-                rline = ''
+                yield start, i + 1, ''.join(rline)
+                rline = []
+                start = i + 1
+        if rline:
+            # an unclosed triple quote swallows the rest of the code
+            spans.append((start, len(code)))
 
 
     def comment_index(line, silent=False):
-        try:
-            comments = [x for x in tokenize.generate_tokens(StringIO(line).readline) if x[0] == tokenize.COMMENT]
-            return comments[0][2][1] if len(comments) == 1 else -1
-        except tokenize.TokenError as e:
+        tokens = tokencache[line]
+        if isinstance(tokens, tokenize.TokenError):
             if not silent and line.find('#') != -1:
-                print(f"[{resourceindicator}] We have a # and:", str(e))
+                print(f"[{resourceindicator}] We have a # and:", str(tokens))
             return -1
+        comments = [x for x in tokens if x[0] == tokenize.COMMENT]
+        return comments[0][2][1] if len(comments) == 1 else -1
 
 
     def join_lines(code):
-        rline = ''
-        for line in code:
-            rline += line
-            if comment_index(line) == -1 and rline.endswith('\\'):
-                rline = rline[:-1]
+        rline = []
+        start = None
+        end = None
+        for s, e, line in code:
+            start = s if start is None else start
+            end = e
+            rline.append(line)
+            if comment_index(line) == -1 and ends_with_backslash(rline):
+                last = next(i for i in reversed(range(len(rline))) if rline[i])
+                rline[last] = rline[last][:-1]
             else:
-                yield rline
-                rline = ''
+                spans.append((start, end))
+                yield start, end, ''.join(rline)
+                rline = []
+                start = None
+        if rline:
+            spans.append((start, end))
 
 
     # def remove_triplequote_comments(code):
@@ -128,7 +243,7 @@ def sanitize(code, codepath, full=False):
 
 
     def remove_quote_comments(code):
-        for line in code:
+        for s, e, line in code:
             l = line.strip()
             repeat = True
             while repeat:
@@ -143,21 +258,40 @@ def sanitize(code, codepath, full=False):
                         repeat = True
                         break
             if l != '':
-                yield line
+                yield s, e, line
 
 
     def remove_comments(code):
-        return (line if (ci := comment_index(line, silent=True)) == -1 else line[:ci] for line in code)
+        return ((s, e, line if (ci := comment_index(line, silent=True)) == -1 else line[:ci]) for s, e, line in code)
 
 
     def rstrip(code):
-        return (line.rstrip(" \t\n\r;") for line in code)
+        return ((s, e, line.rstrip(" \t\n\r;")) for s, e, line in code)
 
 
     def remove_empty_lines(code):
-        return (line for line in code if line != '')
+        return ((s, e, line) for s, e, line in code if line != '')
+
+    lines = list(remove_empty_lines(rstrip(remove_comments(remove_quote_comments(join_lines(join_triplequote_strings(code)))))))
+    return lines, spans
+
+
+def sanitize(code, codepath, full=False, tokencache=None):
+    return [line for _, _, line in sanitize_spans(code, codepath, full, tokencache)[0]]
+
+
+def sanitize_source(code, codepath, tokencache=None):
+    ranges, goodflags = user_code_ranges(code)
+    full, spans = sanitize_spans(code, codepath, True, tokencache)
+
+    # the user code is made of whole joined lines of the full code unless a join crosses a flag line
+    boundaries = {b for r in ranges for b in r}
+    if any(s < b < e for s, e in spans for b in boundaries):
+        user = sanitize([line for r in ranges for line in code[r[0]:r[1]]], codepath, tokencache=tokencache)
+    else:
+        user = [line for s, e, line in full if any(r[0] <= s and e <= r[1] for r in ranges)]
 
-    return list(remove_empty_lines(rstrip(remove_comments(remove_quote_comments(join_lines(join_triplequote_strings(code)))))))
+    return [line for _, _, line in full], user, goodflags
 
 
 def get_comment(line):
@@ -169,7 +303,7 @@ def get_comments(code):
     return (get_comment(line) for line in code)
 
 
-def extract_user_code(code):
+def user_code_ranges(code):
     bflag = 'DO_NOT_EDIT_ANYTHING_ABOVE_THIS_LINE'
     eflag = 'DO_NOT_EDIT_ANYTHING_BELOW_THIS_LINE'
 
@@ -188,190 +322,603 @@ def extract_user_code(code):
                     yield (rangestart, i)
                     rangestart = -1
 
-    return [line for r in sturanges() for line in code[r[0]:r[1]]], goodflags
+    return list(sturanges()), goodflags
+
+
+def extract_user_code(code):
+    ranges, goodflags = user_code_ranges(code)
+    return [line for r in ranges for line in code[r[0]:r[1]]], goodflags
+
+
+LINE_IDS = defaultdict(dict)
+
+
+def intern_lines(lines, lineids):
+    return [lineids.setdefault(line, len(lineids)) for line in lines]
 
 
-def calculate_edit_distance(old, new):
-    sm = edit_distance.SequenceMatcher(old, new)
+def myers_distance(a, b, band=None):
+    if not a:
+        return len(b) if band is None else min(len(b), band)
 
-    width = max(len(l) for l in new)
+    peq = {}
+    for i, x in enumerate(a):
+        peq[x] = peq.get(x, 0) | 1 << i
+
+    mask = (1 << len(a)) - 1
+    top = 1 << len(a) - 1
+    pv, mv, score = mask, 0, len(a)
+    for j, y in enumerate(b, 1):
+        eq = peq.get(y, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv) & mask
+        mh = pv & xh
+        if ph & top:
+            score += 1
+        elif mh & top:
+            score -= 1
+        ph = (ph << 1 | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | ~(xv | ph) & mask
+        mv = ph & xv
+        # the remaining columns can lower the score by at most one each
+        if band is not None and score - (len(b) - j) >= band:
+            return band
+
+    return score if band is None else min(score, band)
+
+
+def calculate_edit_distance(old, new, legitmax=None, lineids=None):
+    if lineids is None:
+        lineids = {}
+    oldids = intern_lines(old, lineids)
+    newids = intern_lines(new, lineids)
+
+    # beyond legitmax the ratio is clamped to 0, so the exact distance is not needed, see mark_banded_distances
+    band = min(max(len(old), len(new)), legitmax) if legitmax else None
+    return {'edit_dist': myers_distance(oldids, newids, band)}
+
+
+def calculate_edit_opcodes(old, new, distance, lineids=None):
+    if distance == 0:
+        # identical code is only shown for its flaws, and its diff is every line kept as it is
+        opcodes = [('equal', i, i, line, '') for i, line in enumerate(new, 1)]
+    else:
+        if lineids is None:
+            lineids = {}
+        sm = edit_distance.SequenceMatcher(intern_lines(old, lineids), intern_lines(new, lineids))
+        # only the pieces of the lines that the rendered text shows are kept, see render_opcodes
+        opcodes = [(tag, i2, j2, '' if j1 == j2 else new[j1], old[i1].strip() if tag in ['delete', 'replace'] else '')
+                   for tag, i1, i2, j1, j2 in sm.get_opcodes()]
+    return {'edit_opcodes': (max(len(l) for l in new), opcodes)}
+
+
+def mark_banded_distances(reportdf, origqiddict):
+    # a distance that reached the band is only known to be at least that
+    _, legitmax = legitrange_columns(reportdf['qid'], origqiddict)
+    band = np.minimum(reportdf[['org-#lines', 'cor-#lines']].max(axis=1), legitmax)
+    dist = reportdf['edit_dist']
+    return dist.where(~(dist >= band), '≥' + dist.astype('Int64').astype(str))
+
+
+def render_opcodes(compactopcodes):
+    width, opcodes = compactopcodes
 
     def format_opcode(opcode):
-        tag, i1, i2, j1, j2 = opcode
+        tag, i2, j2, newline, oldline = opcode
         return ((f'-{i2}' if tag in ['delete', 'replace'] else '').ljust(4) +
                 (f'+{j2}' if tag in ['insert', 'replace'] else '').ljust(4) +
-                ('' if j1 == j2 else new[j1]).ljust(width) +
-                (("  #REMOVED:  " if tag == 'delete' else "  #REPLACED: ") + old[i1].strip() if tag in ['delete', 'replace'] else ''))
+                newline.ljust(width) +
+                (("  #REMOVED:  " if tag == 'delete' else "  #REPLACED: ") + oldline if tag in ['delete', 'replace'] else ''))
 
-    return {'edit_opcodes': 'old new\n' + '\n'.join(format_opcode(opcode) for opcode in sm.get_opcodes()),
-            'edit_dist': sm.distance()}
+    return 'old new\n' + '\n'.join(format_opcode(opcode) for opcode in opcodes)
 
 
-def run_pylint(testfpath):
-    from pylint import lint
+def shown_rows(reportdf, threshold):
+    return ((reportdf['all-inspect'] != '') | (reportdf['ratio'] < threshold)).to_numpy()
 
-    PERFECT = "\n------------------------------------\nYour code has been rated at 10.00/10\n\n"
-    ARGS = ["--disable=all", "--enable=W0104,W0105"]
-    outIO = StringIO()
-    lint.Run([testfpath]+ARGS, reporter=TextReporter(outIO), exit=False)
 
-    outIO.seek(0)
-    output = outIO.read()
+def render_opcodes_column(reportdf, threshold):
+    shown = shown_rows(reportdf, threshold)
+    return [render_opcodes(opcodes) if show and isinstance(opcodes, (tuple, list)) else None
+            for opcodes, show in zip(reportdf['edit_opcodes'], shown)]
 
-    return output == PERFECT or output == "" or output
 
+def write_html_diff(path, org, cor, orgdesc, cordesc):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(difflib.HtmlDiff(wrapcolumn=100).make_file(org, cor, orgdesc, cordesc))
 
-def prepare_vulture_whitelist(srcpath):
-    wlpath = srcpath.parent / (srcpath.stem + '-whitelist.py')
 
-    v = vulture.Vulture()
-    v.scavenge([srcpath])
-    with open(wlpath, 'w') as wlf:
-        print('\n'.join(item.get_whitelist_string() for item in v.get_unused_code()), file=wlf)
+TOKEN_IDS = defaultdict(dict)
+SKIPPED_TOKENS = {tokenize.NEWLINE, tokenize.NL, tokenize.COMMENT, tokenize.DEDENT, tokenize.ENDMARKER}
 
-    return wlpath
 
+def line_tokens(line, tokencache):
+    tokens = tokencache[line]
+    if isinstance(tokens, tokenize.TokenError):
+        return [line.strip()]
+    return [token.string for token in tokens if token.type not in SKIPPED_TOKENS]
 
-def run_vulture(testfpath, vulturewlpath):
-    v = vulture.Vulture()
-    with redirect_stderr(StringIO()) as f:
-        v.scavenge([testfpath, vulturewlpath])
-        errout = f.getvalue()
-    vulpath = vulture.utils.format_path(Path(testfpath).resolve())
-    invalid_syntax_regex = str(vulpath).replace('\\', '\\\\') + r":\d+: invalid syntax at .*"
-    errout = '\n'.join(l for l in errout.splitlines() if not re.match(invalid_syntax_regex, l))
-    output = [errout] if errout else []
-    output += [item.get_report() for item in v.get_unused_code()]
-    return output == [] or '\n'.join(output)
 
+def calculate_token_distance(old, new, oldtokencache, newtokencache, tokenids=None):
+    if tokenids is None:
+        tokenids = {}
+    oldids = intern_lines((token for line in old for token in line_tokens(line, oldtokencache)), tokenids)
+    newids = intern_lines((token for line in new for token in line_tokens(line, newtokencache)), tokenids)
 
-def run_tests(code, vulturewlpath, prepend=''):
-    temp = tempfile.NamedTemporaryFile(mode="w", delete=False)
-    temp.write('\n'.join(code))
-    testfpath = temp.name
-    temp.close()
+    return {'edit_tokdist': myers_distance(oldids, newids),
+            'edit_toklen': max(len(oldids), len(newids))}
 
-    pylintres = run_pylint(testfpath)
-    vultureres = run_vulture(testfpath, vulturewlpath)
 
-    os.remove(testfpath)
+SHINGLE_SIZE = 5
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+# fixed seeds keep the signatures comparable across workers, runs and the report cache
+MINHASH_SEEDS = np.random.default_rng(150).integers(1, np.iinfo(np.uint64).max, size=(2, MINHASH_PERMUTATIONS), dtype=np.uint64)
 
-    if prepend:
-        prepend += '-'
-    return {prepend + 'pylint': pylintres, prepend + 'vultur': vultureres}
 
+def minhash_signature(code, tokencache):
+    tokens = [token for line in code for token in line_tokens(line, tokencache)]
+    if not tokens:
+        return None
 
-def num_colon_follow(code):
-    def colon_follow_in_line(line):
-        try:
-            square_bracket_depth = 0
-            tokens = list(tokenize.generate_tokens(StringIO(line).readline))
+    shingles = {'\0'.join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    # multiply-shift hashing, the products wrap around modulo 2**64 on purpose
+    a, b = MINHASH_SEEDS
+    signature = ((np.outer(a, hashes) + b[:, None]) >> np.uint64(32)).min(axis=1).astype(np.uint32)
+    return signature.tobytes().hex()
 
-            for i, token in enumerate(tokens):
-                if token.type == tokenize.OP:
-                    if token.string == ':' and square_bracket_depth == 0 and tokens[i+1].type != tokenize.NEWLINE:
-                        return True
-                    elif token.string == '[':
-                        square_bracket_depth += 1
-                    elif token.string == ']':
-                        square_bracket_depth -= 1
-            return False
-        except tokenize.TokenError as e:
-            return 0 <= line.find(':') < len(line)-1
 
-    return sum(colon_follow_in_line(line) for line in code)
+def minhash_matrix(signatures):
+    return np.frombuffer(bytes.fromhex(''.join(signatures)), dtype=np.uint32).reshape(-1, MINHASH_PERMUTATIONS)
 
 
-def num_semicolon(code):
-    return '\n'.join(code).count(';')
+PYLINT_ARGS = ["--disable=all", "--enable=W0104,W0105", "--persistent=n"]
+PYLINT_MODULE_HEADER = "************* Module "
+PYLINT_BATCH_SIZE = 25
+TASKS_PER_WORKER = 4
 
 
-def num_comma(code):
-    def num_comma_in_line(line):
+def pylint_rating(stats):
+    if not stats or stats['statement'] == 0:
+        return ''
+
+    score = max(0, 0 if stats['fatal'] else 10.0 - ((float(5 * stats['error'] + stats['warning'] + stats['refactor'] + stats['convention']) / stats['statement']) * 10))
+    rating = f"Your code has been rated at {score:.2f}/10"
+    return f"\n{'-' * len(rating)}\n{rating}\n\n"
+
+
+# per process state that is set up once and reused by every task a pool worker runs
+WORKER_STATE = {}
+
+
+class Tracer(list):
+    enabled = False
+
+    @contextmanager
+    def span(self, name, category='stage', **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter_ns()
         try:
-            count = 0
-            comma_counting_at_level = [True]
-            may_start_function = False
-
-            for token in tokenize.generate_tokens(StringIO(line).readline):
-                if token.type == tokenize.OP:
-                    if token.string == ',' and comma_counting_at_level[-1]:
-                        count += 1
-                    elif token.string == '(':
-                        comma_counting_at_level.append(not may_start_function)
-                    elif token.string == ')':
-                        comma_counting_at_level.pop()
-                may_start_function = token.type == tokenize.NAME
-            return count
-        except tokenize.TokenError as e:
-            return line.count(',') # len(re.findall(r""",\s*(?!"|'|\s|end\s*=)""", line))
+            yield
+        finally:
+            # perf_counter is the system-wide monotonic clock on Linux, so spans from the workers line up with the main process
+            self.append({'name': name, 'cat': category, 'ph': 'X', 'ts': start / 1e3, 'dur': (time.perf_counter_ns() - start) / 1e3,
+                         'pid': os.getpid(), 'tid': os.getpid(), 'args': args})
+
+    def drain(self):
+        events = self[:]
+        self.clear()
+        return events
+
+
+TRACER = Tracer()
+
+
+def write_trace(path, events):
+    names = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': pid, 'args': {'name': 'main' if pid == os.getpid() else f'worker {pid}'}}
+             for pid in sorted({event['pid'] for event in events})]
+    path.write_text(json.dumps({'traceEvents': names + events, 'displayTimeUnit': 'ms'}))
+
+
+def print_slowest_submissions(events, count=10):
+    totals = defaultdict(lambda: [0, None])
+    for event in events:
+        if event['cat'] == 'submission':
+            total = totals[tuple(event['args'].values())]
+            total[0] += event['dur']
+            total[1] = event['pid']
+    if not totals:
+        return
+    print(f"{'submission':<40}{'pid':>8}{'ms':>10}")
+    for submission, (duration, pid) in sorted(totals.items(), key=lambda x: -x[1][0])[:count]:
+        print(f"{'-'.join(submission):<40}{pid:>8}{duration / 1e3:>10.1f}")
+
+
+def pylint_linter():
+    if 'linter' not in WORKER_STATE:
+        from pylint import lint
+        from pylint.reporters.text import TextReporter
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            warmuppath = Path(tempdir) / "warmup.py"
+            warmuppath.write_text("")
+            WORKER_STATE['linter'] = lint.Run([str(warmuppath)]+PYLINT_ARGS, reporter=TextReporter(StringIO()), exit=False).linter
+    return WORKER_STATE['linter']
+
+
+def run_pylint_batch(codes):
+    from pylint.reporters.text import TextReporter
+    from astroid import MANAGER
+
+    linter = pylint_linter()
+    with tempfile.TemporaryDirectory() as tempdir:
+        modnames = {}
+        for code in codes:
+            text = '\n'.join(code)
+            if text not in modnames:
+                with tempfile.NamedTemporaryFile(mode="w", dir=tempdir, delete=False) as temp:
+                    temp.write(text)
+                modnames[text] = Path(temp.name).name
+
+        if not modnames:
+            return {}
+
+        outIO = StringIO()
+        linter.set_reporter(TextReporter(outIO))
+        linter.check([str(Path(tempdir) / modname) for modname in modnames.values()])
+        linter.generate_reports()
+        # the temporary modules are never seen again, so astroid need not keep them
+        for modname in modnames.values():
+            MANAGER.astroid_cache.pop(modname, None)
+
+    messages = {}
+    modname = None
+    for line in outIO.getvalue().splitlines(keepends=True):
+        if line.startswith(PYLINT_MODULE_HEADER):
+            modname = line[len(PYLINT_MODULE_HEADER):].strip()
+            messages[modname] = line
+        elif line.strip() == '':
+            modname = None
+        elif modname:
+            messages[modname] += line
+
+    by_module = linter.stats.by_module
+    return {text: modname not in messages or messages[modname] + pylint_rating(by_module.get(modname))
+            for text, modname in modnames.items()}
+
+
+POINTLESS_MESSAGES = {
+    'W0104': "Statement seems to have no effect (pointless-statement)",
+    'W0105': "String statement has no effect (pointless-string-statement)"
+    }
 
-    return sum(num_comma_in_line(line) for line in code if not any(line.lstrip().startswith(kw + " ") for kw in ["for", "if", "return"]))
 
+class PointlessStatementVisitor(ast.NodeVisitor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.messages = []
+        self.statements = 0
+        self.scope = None
+        self.context = (None, None, [], 0)
+
+    def visit(self, node):
+        # counts statements the way pylint's walker counts astroid statements
+        if isinstance(node, (ast.Try, getattr(ast, 'TryStar', ast.Try))):
+            self.statements += bool(node.handlers) + bool(node.finalbody)
+        elif isinstance(node, (ast.stmt, ast.excepthandler)):
+            self.statements += 1
+        return super().visit(node)
+
+    def generic_visit(self, node):
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                # docstrings are not statements for astroid
+                if field == 'body' and isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and value and \
+                   isinstance(value[0], ast.Expr) and isinstance(value[0].value, ast.Constant) and isinstance(value[0].value.value, str):
+                    value = value[1:]
+                for i, item in enumerate(value):
+                    if isinstance(item, ast.AST):
+                        self.context = (node, field, value, i)
+                        self.visit(item)
+            elif isinstance(value, ast.AST):
+                self.context = (node, field, [value], 0)
+                self.visit(value)
+
+    def visit_scope(self, node):
+        outerscope, self.scope = self.scope, node
+        self.generic_visit(node)
+        self.scope = outerscope
+
+    visit_Module = visit_ClassDef = visit_FunctionDef = visit_AsyncFunctionDef = visit_scope
+
+    def visit_Expr(self, node):
+        parent, field, block, i = self.context
+        expr = node.value
+        if isinstance(expr, ast.Constant) and isinstance(expr.value, str):
+            # attribute docstrings right after an assignment are fine outside of regular functions
+            if not isinstance(self.scope, (ast.FunctionDef, ast.AsyncFunctionDef)) or self.scope.name == '__init__':
+                if i >= 1 and isinstance(block[i-1], (ast.Assign, ast.AnnAssign)):
+                    return
+            self.messages.append((node.lineno, node.col_offset, 'W0105'))
+            return
+
+        if not (isinstance(expr, (ast.Yield, ast.YieldFrom, ast.Await, ast.Call))
+                or (isinstance(parent, ast.Try) and parent.handlers and field == 'body' and len(block) == 1)
+                or (isinstance(expr, ast.Constant) and expr.value is Ellipsis)
+                or any(isinstance(n, ast.Call) for n in ast.walk(expr))):
+            self.messages.append((node.lineno, node.col_offset, 'W0104'))
+        self.generic_visit(node)
+
+
+def run_pointless_check(code, modname='Main'):
+    try:
+        tree = ast.parse('\n'.join(code))
+    except (SyntaxError, ValueError):
+        return True
+
+    psv = PointlessStatementVisitor()
+    psv.visit(tree)
+    if not psv.messages:
+        return True
+
+    stats = {'statement': psv.statements, 'warning': len(psv.messages), 'error': 0, 'fatal': 0, 'refactor': 0, 'convention': 0}
+    return (f"{PYLINT_MODULE_HEADER}{modname}\n" +
+            ''.join(f"{modname}:{line}:{col}: {msgid}: {POINTLESS_MESSAGES[msgid]}\n" for line, col, msgid in sorted(psv.messages)) +
+            pylint_rating(stats))
+
+
+def pylint_findings(result):
+    if result is True:
+        return []
+    return [m[1] if (m := re.match(r"^.*?:(\d+:\d+: [A-Z]\d{4}: .*)$", l)) else l
+            for l in result.splitlines() if l and not l.startswith((PYLINT_MODULE_HEADER, '---'))]
+
+
+def check_pylint_compat(native, pylintres, resourceindicator):
+    if pylint_findings(native) != pylint_findings(pylintres):
+        print(f"[{resourceindicator}] pylint-compat mismatch!\n  native: {native!r}\n  pylint: {pylintres!r}")
+
+
+def vulture_whitelist_names(item):
+    if item.typ == "unreachable_code":
+        return set()
+    return {'_', item.name} if item.typ in ["attribute", "method", "property"] else {item.name}
+
+
+@lru_cache(maxsize=None)
+def vulture_bundled_whitelist(import_name):
+    path = Path("whitelists") / (import_name + "_whitelist.py")
+    try:
+        module_data = pkgutil.get_data("vulture", str(path))
+    except OSError:
+        return frozenset()
+
+    v = vulture.Vulture()
+    v.scan(module_data.decode("utf-8"), filename=path)
+    return frozenset(v.used_names)
+
+
+def prepare_vulture_whitelist(srcpath, data=None):
+    v = vulture.Vulture()
+    if data is None:
+        v.scavenge([srcpath])
+    else:
+        v.scan(TextIOWrapper(BytesIO(data)).read(), filename=srcpath)
+        for import_name in {item.name for item in v.defined_imports}:
+            v.used_names |= vulture_bundled_whitelist(import_name)
+    return frozenset(chain.from_iterable(vulture_whitelist_names(item) for item in v.get_unused_code()))
 
-def num_exec(code):
-    return '\n'.join(code).count('exec(')
 
+def analyze_vulture(code, vulturewl, filename='Main'):
+    v = vulture.Vulture()
+    v.code = code.splitlines()
+    v.noqa_lines = vulture.noqa.parse_noqa(v.code)
+    v.filename = Path(filename)
+
+    try:
+        v.visit(ast.parse(code, filename=filename, type_comments=True))
+    except (SyntaxError, ValueError) as e:
+        return {'error': e, 'unused': []}
+
+    v.used_names |= vulturewl
+    for import_name in {item.name for item in v.defined_imports}:
+        v.used_names |= vulture_bundled_whitelist(import_name)
+
+    return {'error': None, 'unused': v.get_unused_code()}
+
+
+def run_vulture(code, vulturewl, filename='Main'):
+    result = analyze_vulture('\n'.join(code), vulturewl, filename)
+    output = []
+    if isinstance(e := result['error'], ValueError):
+        output.append(f'{filename}: invalid source code "{e}"')
+    elif e and e.msg != 'invalid syntax':
+        output.append(f"{filename}:{e.lineno}: {e.msg}" + (f' at "{e.text.strip()}"' if e.text else ""))
+    output += [item.get_report() for item in result['unused']]
+    return output == [] or '\n'.join(output)
 
-def num_global_nonlocal(code):
-    return '\n'.join(code).count('global') + '\n'.join(code).count('nonlocal')
 
+def run_lint(code, name='Main', pylintresults=None, lintengine='native', codepath=None):
+    if lintengine == 'native':
+        return run_pointless_check(code, name)
 
-def num_ternary(code):
-    return sum(len(re.findall(r"""\bif\b.*\belse\b""", line)) for line in code)
+    if pylintresults is None:
+        pylintresults = run_pylint_batch([code])
+    pylintres = pylintresults['\n'.join(code)]
+    if lintengine == 'compat':
+        resourceindicator = ('/'.join(codepath.parts[-6:-2]) if codepath else name) + ' (full)'
+        check_pylint_compat(run_pointless_check(code, name), pylintres, resourceindicator)
+    return pylintres
 
 
-def num_multi_assign(code):
-    return sum(max(0, len(re.findall(r"""[^=!+\-*\^\|&<>%/]=[^=]""", line)) - 1) for line in code)
+def num_colon_follow(code, tokencache=None):
+    if tokencache is None:
+        tokencache = TokenCache()
 
+    def colon_follow_in_line(line):
+        tokens = tokencache[line]
+        if isinstance(tokens, tokenize.TokenError):
+            return 0 <= line.find(':') < len(line)-1
 
-def num_self_assign(code):
-    return sum(1 if re.match(r"""^\s*(\w+)\s*=\s*\1\s*$""", line) else 0 for line in code)
+        square_bracket_depth = 0
+        for i, token in enumerate(tokens):
+            if token.type == tokenize.OP:
+                if token.string == ':' and square_bracket_depth == 0 and tokens[i+1].type != tokenize.NEWLINE:
+                    return True
+                elif token.string == '[':
+                    square_bracket_depth += 1
+                elif token.string == ']':
+                    square_bracket_depth -= 1
+        return False
 
+    return sum(colon_follow_in_line(line) for line in code)
 
-def num_empty_string_return(code):
-    return sum(1 if re.match(r"""^\s*return\s*("\s*"|'\s*'|\("\s*"\)|\('\s*'\))\s*$""", line) else 0 for line in code)
 
+def num_comma(code, tokencache=None):
+    if tokencache is None:
+        tokencache = TokenCache()
 
-def num_silly_and_or(code):
-    aoexp = r"""\b(and|or)\b"""
-    strexp = r"""\s*("[^"]*"|'[^']*')\s*"""
-    rendexp = r"""(:|\)|\bor\b|\band\b)"""
-    lendexp = r"""(if\b|\(|\bor\b|\band\b|^\s*)"""
-    return sum(len(re.findall(aoexp + strexp + rendexp + "|" + lendexp + strexp + aoexp, line)) for line in code)
+    def num_comma_in_line(line):
+        tokens = tokencache[line]
+        if isinstance(tokens, tokenize.TokenError):
+            return line.count(',') # len(re.findall(r""",\s*(?!"|'|\s|end\s*=)""", line))
 
+        count = 0
+        comma_counting_at_level = [True]
+        may_start_function = False
+
+        for token in tokens:
+            if token.type == tokenize.OP:
+                if token.string == ',' and comma_counting_at_level[-1]:
+                    count += 1
+                elif token.string == '(':
+                    comma_counting_at_level.append(not may_start_function)
+                elif token.string == ')':
+                    comma_counting_at_level.pop()
+            may_start_function = token.type == tokenize.NAME
+        return count
 
-def num_stray_and_or(code):
-    return sum(len(re.findall(r"""^(?:(?!if)(?!while).)*?\b(and|or)\b.*""", line)) for line in code)
+    return sum(num_comma_in_line(line) for line in code if not any(line.lstrip().startswith(kw + " ") for kw in ["for", "if", "return"]))
 
 
-def num_blank_prints(code):
-    count = 0
+SILLY_AND_OR_AOEXP = r"""\b(and|or)\b"""
+SILLY_AND_OR_STREXP = r"""\s*("[^"]*"|'[^']*')\s*"""
+SILLY_AND_OR_RENDEXP = r"""(:|\)|\bor\b|\band\b)"""
+SILLY_AND_OR_LENDEXP = r"""(if\b|\(|\bor\b|\band\b|^\s*)"""
+
+TERNARY_RE = re.compile(r"""\bif\b.*\belse\b""")
+MULTI_ASSIGN_RE = re.compile(r"""[^=!+\-*\^\|&<>%/]=[^=]""")
+SELF_ASSIGN_RE = re.compile(r"""^\s*(\w+)\s*=\s*\1\s*$""")
+EMPTY_STRING_RETURN_RE = re.compile(r"""^\s*return\s*("\s*"|'\s*'|\("\s*"\)|\('\s*'\))\s*$""")
+SILLY_AND_OR_RE = re.compile(SILLY_AND_OR_AOEXP + SILLY_AND_OR_STREXP + SILLY_AND_OR_RENDEXP + "|" + SILLY_AND_OR_LENDEXP + SILLY_AND_OR_STREXP + SILLY_AND_OR_AOEXP)
+STRAY_AND_OR_RE = re.compile(r"""^(?:(?!if)(?!while).)*?\b(and|or)\b.*""")
+LOOP_RE = re.compile(r"^(\s*)(for|while) ")
+BLANK_PRINT_RES = (
+    re.compile(r"""print\s*\(\s*(("|'|\"\"\"|''')\s*\2)?\s*\)"""),
+    re.compile(r"""print\s*\(\s*(("|'|\"\"\"|''')\s*\2)?\s*$"""),
+    re.compile(r"""print\s*\(\s*("|'|\"\"\"|''')\s*$"""),
+    re.compile(r"""print\s*\(\s*$"""),
+    )
+
+# blank prints only count outside loops, so the detector keeps the loop indentation of the lines it has seen
+def blank_print_detector():
     loopindent = []
-    for line in code:
+
+    def num_blank_prints(line):
         # skip the empty lines
         if line.strip() == "":
-            continue
+            return 0
 
         # reduce current indentation level so much so that we've dedented
         while loopindent and not line.startswith(" " * (loopindent[-1] + 1)):
             loopindent.pop()
 
-        match = re.match(r"^(\s*)(for|while) ", line)
+        match = LOOP_RE.match(line)
         if match:
             loopindent.append(len(match[1]))
-        elif not loopindent:
-            count += len(re.findall(r"""print\s*\(\s*(("|'|\"\"\"|''')\s*\2)?\s*\)""", line))
-            count += len(re.findall(r"""print\s*\(\s*(("|'|\"\"\"|''')\s*\2)?\s*$""", line))
-            count += len(re.findall(r"""print\s*\(\s*("|'|\"\"\"|''')\s*$""", line))
-            count += len(re.findall(r"""print\s*\(\s*$""", line))
-    return count
+        elif not loopindent and 'print' in line:
+            return sum(len(regex.findall(line)) for regex in BLANK_PRINT_RES)
+        return 0
+
+    return num_blank_prints
+
+
+DETECTORS = {}
+DETECTOR_TIMES = defaultdict(lambda: [0, 0])
+
+
+# a stateful per-line detector is registered as a factory, called for a fresh line function on every scan
+def register_detector(key, function, flawless=0, perline=False, stateful=False):
+    DETECTORS[key] = {'function': function, 'flawless': flawless, 'perline': perline, 'stateful': stateful}
+
+
+def record_detector_time(key, calls, elapsed):
+    DETECTOR_TIMES[key][0] += calls
+    DETECTOR_TIMES[key][1] += elapsed
 
-    # return len(re.findall(r"""print\s*\(\s*(("|'|\"\"\"|''')\s*\2)?\s*\)""", '\n'.join(code)))
 
+def scan_detectors(code, keys, timed=False):
+    detectors = [(key, DETECTORS[key]['function']() if DETECTORS[key]['stateful'] else DETECTORS[key]['function']) for key in keys]
+    counts = dict.fromkeys(keys, 0)
+    if not timed:
+        for line in code:
+            for key, detector in detectors:
+                counts[key] += detector(line)
+        return counts
+
+    # timing every call costs about as much as the cheap detectors themselves, so it is only done on request
+    elapsed = dict.fromkeys(keys, 0)
+    for line in code:
+        for key, detector in detectors:
+            start = time.perf_counter_ns()
+            counts[key] += detector(line)
+            elapsed[key] += time.perf_counter_ns() - start
+
+    for key in keys:
+        record_detector_time(key, 1, elapsed[key])
+    return counts
 
-def num_continue(code):
-    return sum(line.strip() == "continue" for line in code)
+
+def detect(side, skipped=()):
+    enabled = [key for key in DETECTORS if key not in skipped]
+    with TRACER.span('line detectors', 'detector', side=side['name']):
+        counts = scan_detectors(side['code'], [key for key in enabled if DETECTORS[key]['perline']], WORKER_STATE.get('detectortimes', False))
+
+    report = {}
+    for key in enabled:
+        if DETECTORS[key]['perline']:
+            report[f"{side['name']}-{key}"] = counts[key]
+        else:
+            start = time.perf_counter_ns()
+            with TRACER.span(key, 'detector', side=side['name']):
+                report[f"{side['name']}-{key}"] = DETECTORS[key]['function'](side)
+            record_detector_time(key, 1, time.perf_counter_ns() - start)
+    return report
+
+
+# the substring checks in front of the regexes are necessary for a match and skip most lines cheaply
+register_detector('#lines', lambda side: len(side['code']), flawless=None)
+register_detector('#colfol', lambda side: num_colon_follow(side['code'], side['tokens']))
+register_detector('#semcol', lambda line: line.count(';'), perline=True)
+register_detector('#comma', lambda side: num_comma(side['code'], side['tokens']))
+register_detector('#exec', lambda line: line.count('exec('), perline=True)
+register_detector('#mulas', lambda line: max(0, len(MULTI_ASSIGN_RE.findall(line)) - 1) if '=' in line else 0, perline=True)
+register_detector('#globl', lambda line: line.count('global') + line.count('nonlocal'), perline=True)
+register_detector('#tern', lambda line: len(TERNARY_RE.findall(line)) if 'else' in line else 0, perline=True)
+register_detector('#selas', lambda line: 1 if '=' in line and SELF_ASSIGN_RE.match(line) else 0, perline=True)
+register_detector('#esret', lambda line: 1 if 'return' in line and EMPTY_STRING_RETURN_RE.match(line) else 0, perline=True)
+register_detector('#silao', lambda line: len(SILLY_AND_OR_RE.findall(line)) if 'and' in line or 'or' in line else 0, perline=True)
+register_detector('#sryao', lambda line: len(STRAY_AND_OR_RE.findall(line)) if 'and' in line or 'or' in line else 0, perline=True)
+register_detector('#blprn', blank_print_detector, perline=True, stateful=True)
+register_detector('#cont', lambda line: int(line.strip() == "continue"), perline=True)
+register_detector('flagOK', lambda side: side['goodflags'], flawless=True)
+register_detector('pylint', lambda side: run_lint(side['full'], side['name'], side['pylintresults'], side['lintengine'], side['path']), flawless=True)
+register_detector('vultur', lambda side: run_vulture(side['full'], side['vulturewl'], side['name']), flawless=True)
 
 
 # class MultiAssignCountVisitor(ast.NodeVisitor):
@@ -395,109 +942,177 @@ def num_continue(code):
 #   return sum(0 if (eqidx := line.find('=')) == -1 else line[:eqidx].count(',') for line in code)
 
 
-flawless = {
-    'org-#colfol': 0,
-    'org-#semcol': 0,
-    'org-#comma': 0,
-    'org-#exec': 0,
-    'org-#mulas': 0,
-    'org-#globl': 0,
-    'org-#tern': 0,
-    'org-#selas': 0,
-    'org-#esret': 0,
-    'org-#silao': 0,
-    'org-#sryao': 0,
-    'org-#blprn': 0,
-    'org-#cont': 0,
-    'org-flagOK': True,
-    'org-pylint': True,
-    'org-vultur': True,
-    'cor-#colfol': 0,
-    'cor-#semcol': 0,
-    'cor-#comma': 0,
-    'cor-#exec': 0,
-    'cor-#mulas': 0,
-    'cor-#globl': 0,
-    'cor-#tern': 0,
-    'cor-#selas': 0,
-    'cor-#esret': 0,
-    'cor-#silao': 0,
-    'cor-#sryao': 0,
-    'cor-#blprn': 0,
-    'cor-#cont': 0,
-    'cor-flagOK': True,
-    'cor-pylint': True,
-    'cor-vultur': True
-    }
+flawless = {f'{pf}-{key}': detector['flawless'] for pf in ('org', 'cor') for key, detector in DETECTORS.items() if detector['flawless'] is not None}
+
+
+# filled in from the fingerprints once all reports are in, see find_copies
+flawless['cor-copies'] = ''
 
 
 def get_flaws(report):
     return ', '.join(k for k in flawless if k in report and flawless[k] != report[k])
 
 
-def get_report(orgpath, corpath, vulturewlpath, should_sanitize=True):
-    with open(corpath) as corfile:
-        corfull = corfile.read().splitlines()
-        cor, corgoodflags = extract_user_code(corfull)
+def get_flaws_column(df, prefix=''):
+    flaws = np.full(len(df), '', dtype=object)
+    for k in flawless:
+        if k.startswith(prefix) and k in df:
+            flawed = (df[k] != flawless[k]).to_numpy()
+            flaws = np.where(flawed, np.where(flaws == '', k, flaws + ', ' + k), flaws)
+    return pd.Series(flaws, index=df.index)
+
+
+def read_code(path, data=None):
+    if data is None:
+        with open(path) as file:
+            return file.read().splitlines()
+    return TextIOWrapper(BytesIO(data)).read().splitlines()
 
+
+def read_side(path, data=None, should_sanitize=True):
+    tokens = TokenCache()
+    full = read_code(path, data)
     if should_sanitize:
-        cor = sanitize(cor, corpath)
+        full, code, goodflags = sanitize_source(full, path, tokens)
+    else:
+        code, goodflags = extract_user_code(full)
+    return code, full, goodflags, tokens
 
-    if len(cor) == 0:
+
+def read_sources(orgpath, corpath, should_sanitize=True, orgdata=None, cordata=None):
+    corside = read_side(corpath, cordata, should_sanitize)
+    if len(corside[0]) == 0:
         return False
 
-    with open(orgpath) as orgfile:
-        orgfull = orgfile.read().splitlines()
-        org, orggoodflags = extract_user_code(orgfull)
+    return read_side(orgpath, orgdata, should_sanitize), corside
 
-    if should_sanitize:
-        orgfull = sanitize(orgfull, orgpath, True)
-        corfull = sanitize(corfull, corpath, True)
-        org = sanitize(org, orgpath)
-
-    orgreport = {
-        'org-#lines' : len(org),
-        'org-#colfol': num_colon_follow(org),
-        'org-#semcol': num_semicolon(org),
-        'org-#comma': num_comma(org),
-        'org-#exec': num_exec(org),
-        'org-#mulas': num_multi_assign(org),
-        'org-#globl': num_global_nonlocal(org),
-        'org-#tern': num_ternary(org),
-        'org-#selas': num_self_assign(org),
-        'org-#esret': num_empty_string_return(org),
-        'org-#silao': num_silly_and_or(org),
-        'org-#sryao': num_stray_and_or(org),
-        'org-#blprn': num_blank_prints(org),
-        'org-#cont': num_continue(org),
-        'org-flagOK': orggoodflags,
-        } | run_tests(orgfull, vulturewlpath, 'org')
-    correport = {
-        'cor-#lines': len(cor),
-        'cor-#colfol': num_colon_follow(cor),
-        'cor-#semcol': num_semicolon(cor),
-        'cor-#comma': num_comma(cor),
-        'cor-#exec': num_exec(cor),
-        'cor-#mulas': num_multi_assign(cor),
-        'cor-#globl': num_global_nonlocal(cor),
-        'cor-#tern': num_ternary(cor),
-        'cor-#selas': num_self_assign(cor),
-        'cor-#esret': num_empty_string_return(cor),
-        'cor-#silao': num_silly_and_or(cor),
-        'cor-#sryao': num_stray_and_or(cor),
-        'cor-#blprn': num_blank_prints(cor),
-        'org-#cont': num_continue(cor),
-        'cor-flagOK': corgoodflags
-        } | run_tests(corfull, vulturewlpath, 'cor')
-    report = calculate_edit_distance(org, cor) | orgreport | correport
-    return report, get_flaws(orgreport) == "", get_flaws(correport) == ""
-
-
-def subreport(report, tag):
-    return {k: v for k, v in report.items() if (k.startswith(f"{tag}-") if tag else "-" not in k)}
-
-
-def collect_gradebook(path, suffix):
+
+DETECTOR_VERSION = 7
+REPORT_CACHE_MAX_MB = 256
+
+
+def report_cache_key(sources, vulturewl, lintengine, legitmax=None, skipped=(), rendering=None):
+    (org, orgfull, orggoodflags, _), (cor, corfull, corgoodflags, _) = sources
+    keyparts = [DETECTOR_VERSION, lintengine, sorted(vulturewl), legitmax, sorted(skipped), rendering, org, orgfull, orggoodflags, cor, corfull, corgoodflags]
+    return hashlib.sha256(json.dumps(keyparts).encode()).hexdigest()
+
+
+def side_cache_key(stuid, qid, data, vulturewl, lintengine, skipped=()):
+    keyparts = [DETECTOR_VERSION, 'side', stuid, qid, lintengine, sorted(vulturewl), sorted(skipped), hashlib.sha256(data).hexdigest()]
+    return hashlib.sha256(json.dumps(keyparts).encode()).hexdigest()
+
+
+class ReportCache:
+    def __init__(self, path):
+        self.path = path
+        self.fetched = {}
+
+    def __enter__(self):
+        self.db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS reports (key TEXT PRIMARY KEY, reportpack TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+        return self
+
+    def __exit__(self, *exc):
+        self.db.close()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key):
+        if key not in self.fetched:
+            row = self.db.execute("SELECT reportpack FROM reports WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE reports SET used = ? WHERE key = ?", (time.time(), key))
+            self.fetched[key] = tuple(json.loads(row[0]))
+        return self.fetched[key]
+
+    def put(self, key, reportpack):
+        value = json.dumps(reportpack)
+        self.db.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?)", (key, value, len(value), time.time()))
+        self.fetched[key] = reportpack
+
+    def evict(self, maxbytes):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM reports").fetchone()[0]
+        stale = []
+        for key, size in self.db.execute("SELECT key, size FROM reports ORDER BY used"):
+            if total <= maxbytes:
+                break
+            stale.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM reports WHERE key = ?", stale)
+        return len(stale)
+
+
+def analyze_side(side, skipped=()):
+    report = detect(side, skipped)
+    with TRACER.span('fingerprints', 'distance', side=side['name']):
+        report[f"{side['name']}-minhash"] = minhash_signature(side['code'], side['tokens'])
+    return report
+
+
+# rendering holds what scoring decides on whether a row's diff is shown: --render-below, the ratio policy and distance,
+# and the question's legitrange
+def pair_rendering(rendering, qid):
+    if rendering is None:
+        return None
+    return [rendering['below'], rendering['policy'], rendering['distance'], rendering['legitranges'].get(qid)]
+
+
+def row_shown(report, flawed, rendering):
+    if rendering is None or flawed:
+        return True
+    below, policy, distance, legitrange = rendering
+    legitmin, legitmax = legitrange or (np.nan, np.nan)
+    return calculate_ratio(policy, distance, report['org-#lines'], report['cor-#lines'], report['edit_dist'],
+                           report['edit_tokdist'], report['edit_toklen'], legitmin, legitmax) < below
+
+
+# orgside is the memo entry of an original shared by all of its corrections, its report is filled
+# in by whichever of them is analyzed first and kept in the cache for the following runs
+def get_report(orgpath, corpath, vulturewl, should_sanitize=True, sources=None, pylintresults=None, lintengine='native', cache=None, legitmax=None, lineids=None, tokenids=None, skipped=(), orgside=None, rendering=None):
+    if sources is None:
+        sources = read_sources(orgpath, corpath, should_sanitize)
+
+    if not sources:
+        return False
+
+    if cache is not None:
+        cachekey = report_cache_key(sources, vulturewl, lintengine, legitmax, skipped, rendering)
+        if (reportpack := cache.get(cachekey)) is not None:
+            return reportpack
+
+    (org, orgfull, orggoodflags, orgtokens), (cor, corfull, corgoodflags, cortokens) = sources
+
+    runoptions = {'vulturewl': vulturewl, 'pylintresults': pylintresults, 'lintengine': lintengine}
+    if orgside is not None and orgside['report'] is not None:
+        orgreport = orgside['report']
+    else:
+        orgreport = analyze_side({'name': 'org', 'code': org, 'full': orgfull, 'goodflags': orggoodflags, 'tokens': orgtokens, 'path': orgpath} | runoptions, skipped)
+        if orgside is not None:
+            orgside['report'] = orgreport
+            if cache is not None:
+                cache.put(orgside['key'], [org, orgfull, orggoodflags, orgreport])
+    correport = analyze_side({'name': 'cor', 'code': cor, 'full': corfull, 'goodflags': corgoodflags, 'tokens': cortokens, 'path': corpath} | runoptions, skipped)
+    with TRACER.span('edit distance', 'distance'):
+        report = calculate_edit_distance(org, cor, legitmax, lineids)
+    with TRACER.span('token distance', 'distance'):
+        report |= calculate_token_distance(org, cor, orgtokens, cortokens, tokenids)
+    report |= orgreport | correport
+    reportpack = report, get_flaws(orgreport) == "", get_flaws(correport) == ""
+    # the diff is only worked out for the rows that the report is going to show, the copy flags are not known yet here,
+    # so the few rows that only those bring up get theirs in the main process
+    report['edit_opcodes'] = None
+    if row_shown(report, not (reportpack[1] and reportpack[2]), rendering):
+        with TRACER.span('edit opcodes', 'distance'):
+            report |= calculate_edit_opcodes(org, cor, report['edit_dist'], lineids)
+    if cache is not None:
+        cache.put(cachekey, reportpack)
+    return reportpack
+
+
+def parse_gradebook(path, suffix):
     with warnings.catch_warnings(record=True):
         gradebook = pd.read_excel(path, header=1)
 
@@ -506,9 +1121,46 @@ def collect_gradebook(path, suffix):
     if len(qlists := gradebook["Question Id List"].unique()) != 1:
         print(f"Gradebook {path.name} contains multiple Question Id Lists: {qlists}")
 
-    return ({'user': f"user{r['User ID']}", 'qid': f"question{q}", f'grade-{suffix}': g, f'gbook-{suffix}': f'=HYPERLINK("{path}")'}
-            for i, r in gradebook.iterrows()
-            for q, g in zip(str(r["Question Id List"]).split(", "), r[gradecolumns]))
+    qids = gradebook["Question Id List"].astype(str).str.split(", ").explode()
+    qids = qids.set_axis(pd.MultiIndex.from_arrays([qids.index, qids.groupby(level=0).cumcount()]))
+    grades = gradebook[gradecolumns].set_axis(range(len(gradecolumns)), axis=1).stack(dropna=False)
+    pairs = qids.to_frame('qid').join(grades.rename('grade'), how='inner').sort_index()
+    return pd.DataFrame({
+        'user': "user" + gradebook['User ID'].astype(str).to_numpy()[pairs.index.get_level_values(0)],
+        'qid': "question" + pairs['qid'].to_numpy(),
+        f'grade-{suffix}': pairs['grade'].to_numpy(),
+        f'gbook-{suffix}': f'=HYPERLINK("{path}")',
+        })
+
+
+def collect_gradebook(path, suffix, cachedir):
+    stat = path.stat()
+    key = [str(path), stat.st_mtime_ns, stat.st_size]
+    cachepath = cachedir / f"{path.parent.name}-{path.stem}.pkl"
+    if cachepath.is_file() and (cached := pd.read_pickle(cachepath))['key'] == key:
+        return cached['gradebook']
+    with TRACER.span('parse gradebook', 'gradebook', path=path.name):
+        gradebook = parse_gradebook(path, suffix)
+    cachedir.mkdir(parents=True, exist_ok=True)
+    pd.to_pickle({'key': key, 'gradebook': gradebook}, cachepath)
+    return gradebook
+
+
+def read_grade(path):
+    with open(path) as f:
+        return float(f.readline())
+
+
+def override_grades(df, column, overrides):
+    overrides = pd.Series(overrides, name=column, dtype=float)
+    if overrides.empty:
+        return df.copy()
+    overrides.index.names = df.index.names
+    missing = overrides.index.difference(df.index)
+    df = df.copy() if missing.empty else pd.concat([df, overrides[missing].to_frame()])
+    mask = df.index.isin(overrides.index)
+    df.loc[mask, column] = overrides.reindex(df.index[mask]).to_numpy()
+    return df
 
 
 def create_nppath_backref(ppath, nppath):
@@ -517,106 +1169,510 @@ def create_nppath_backref(ppath, nppath):
         bref.write(str(os.path.relpath(nppath, brefpath.parent)))
 
 
-def consider_creating_patch(isperfect, ppath, path):
+def consider_creating_patch(isperfect, ppath, path, data=None):
     if isperfect or (ppath.exists() and path.samefile(ppath)):
         return path
 
     ppath.parent.mkdir(parents=True)
-    shutil.copyfile(path, ppath)
+    if data is None:
+        shutil.copyfile(path, ppath)
+    else:
+        # streamed sources are extracted only when they need a patch copy
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        ppath.write_bytes(data)
     create_nppath_backref(ppath, path)
     return ppath
 
 
-def analyze_stuq(examid, stuid, oqid, npcpath, pcpath, npopath, popath, reportworthy, vulturewlpath, examhome):
+def pick_source(ppath, nppath, npdata):
+    return (ppath, None) if ppath.is_file() else (nppath, npdata)
+
+
+def read_stuq_sources(examid, stuid, oqid, npcpath, pcpath, npopath, popath, reportworthy, vulturewl, examhome, npodata=None, npcdata=None, legitmax=None,
+                      orgsides=None, cache=None, lintengine='native', skipped=()):
+    if not reportworthy:
+        return None, None
+
+    opath, odata = pick_source(popath, npopath, npodata)
+    cpath, cdata = pick_source(pcpath, npcpath, npcdata)
+    if orgsides is None:
+        return read_sources(opath, cpath, orgdata=odata, cordata=cdata), None
+
+    corside = read_side(cpath, cdata)
+    if len(corside[0]) == 0:
+        return False, None
+
+    # an original with several correction projects is read and analyzed once for all of them
+    key = side_cache_key(stuid, oqid, odata if odata is not None else opath.read_bytes(), vulturewl, lintengine, skipped)
+    if (orgside := orgsides.get(key)) is None:
+        if cache is not None and (cached := cache.get(key)) is not None:
+            org, orgfull, orggoodflags, orgreport = cached
+            orgside = {'key': key, 'sources': (org, orgfull, orggoodflags, TokenCache()), 'report': orgreport}
+        else:
+            orgside = {'key': key, 'sources': read_side(opath, odata), 'report': None}
+        orgsides[key] = orgside
+    return (orgside['sources'], corside), orgside
+
+
+HYPERLINK_COLUMNS = ('org', 'org*', 'cor', 'cor*')
+
+
+@lru_cache
+def report_columns(skipped=()):
+    keys = [key for key in DETECTORS if key not in skipped]
+    return ('user', 'qid',
+            'org', 'org*', *(f'org-{key}' for key in keys),
+            'cor', 'cor*', *(f'cor-{key}' for key in keys),
+            'edit_opcodes', 'edit_dist', 'edit_tokdist', 'edit_toklen', 'org-minhash', 'cor-minhash')
+
+
+# records travel back from the pool workers as plain tuples in report_columns order, which pickle
+# far smaller than dicts repeating every key, and the report paths are wrapped into HYPERLINKs only
+# once the whole column is in a frame
+def make_record(row, skipped=()):
+    return tuple(row.get(column) for column in report_columns(skipped))
+
+
+def records_frame(records, columns):
+    if not records:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.DataFrame(dict(zip(columns, map(list, zip(*records)))))
+    for column in HYPERLINK_COLUMNS:
+        linked = df[column].notna()
+        df.loc[linked, column] = '=HYPERLINK("' + df.loc[linked, column] + '")'
+    return df
+
+
+def analyze_stuq(examid, stuid, oqid, npcpath, pcpath, npopath, popath, reportworthy, vulturewl, examhome, npodata=None, npcdata=None, legitmax=None, sources=None, pylintresults=None, lintengine='native', cache=None, skipped=(), orgside=None, rendering=None):
     if reportworthy:
-        opath = popath if popath.is_file() else npopath
-        cpath = pcpath if pcpath.is_file() else npcpath
-        reportpack = get_report(opath, cpath, vulturewlpath)
+        opath, odata = pick_source(popath, npopath, npodata)
+        cpath, cdata = pick_source(pcpath, npcpath, npcdata)
+        if sources is None:
+            sources = read_sources(opath, cpath, orgdata=odata, cordata=cdata)
+        reportpack = get_report(opath, cpath, vulturewl, sources=sources, pylintresults=pylintresults, lintengine=lintengine, cache=cache,
+                                legitmax=legitmax, lineids=LINE_IDS[oqid], tokenids=TOKEN_IDS[oqid], skipped=skipped, orgside=orgside,
+                                rendering=pair_rendering(rendering, oqid))
         if reportpack:
             report, orgtestperfect, cortestperfect = reportpack
-            opath = consider_creating_patch(orgtestperfect, popath, opath)
-            cpath = consider_creating_patch(cortestperfect, pcpath, cpath)
-            return {
+            opath = consider_creating_patch(orgtestperfect, popath, opath, odata)
+            cpath = consider_creating_patch(cortestperfect, pcpath, cpath, cdata)
+            return make_record({
                 'user': stuid,
                 # 'qnum': ns.origqiddict[oqid]['qnum'],
                 'qid': oqid,
                 # 'sect': ns.correctiondict[stuid][oqid]['section'],
                 # 'exam': examid,
-                'org': f'=HYPERLINK("{opath.relative_to(examhome)}")',
-                'org*': f'=HYPERLINK("{npopath.relative_to(examhome)}")' if opath == popath else None
-                } | subreport(report, 'org') | {
-                'cor': f'=HYPERLINK("{cpath.relative_to(examhome)}")',
-                'cor*': f'=HYPERLINK("{npcpath.relative_to(examhome)}")' if cpath == pcpath else None
-                } | subreport(report, 'cor') | subreport(report, False)
+                'org': str(opath.relative_to(examhome)),
+                'org*': str(npopath.relative_to(examhome)) if opath == popath else None,
+                'cor': str(cpath.relative_to(examhome)),
+                'cor*': str(npcpath.relative_to(examhome)) if cpath == pcpath else None
+                } | report, skipped)
 
-    return {
+    return make_record({
         'user': stuid,
         'qid': oqid,
-        'org': f'=HYPERLINK("{opath.relative_to(examhome)}")',
-        'cor': f'=HYPERLINK("{cpath.relative_to(examhome)}")'
-        }
+        'org': str(opath.relative_to(examhome)),
+        'cor': str(cpath.relative_to(examhome))
+        }, skipped)
+
+
+def worker_cache(cachepath):
+    if WORKER_STATE.get('cachepath') != cachepath:
+        if 'cache' in WORKER_STATE:
+            WORKER_STATE['cache'].__exit__(None, None, None)
+        WORKER_STATE['cache'] = ReportCache(cachepath).__enter__()
+        WORKER_STATE['cachepath'] = cachepath
+    WORKER_STATE['cache'].fetched.clear()
+    return WORKER_STATE['cache']
+
+
+def init_worker(lintengine='native', cachepath=None, trace=False, detectortimes=False):
+    # a forked worker starts with a copy of the spans the main process has recorded so far
+    TRACER.clear()
+    TRACER.enabled = trace
+    WORKER_STATE['detectortimes'] = detectortimes
+    start = time.perf_counter()
+    with TRACER.span('worker startup', 'worker'):
+        for whitelistpath in (Path(vulture.__file__).parent / "whitelists").glob("*_whitelist.py"):
+            vulture_bundled_whitelist(whitelistpath.name[:-len("_whitelist.py")])
+        if lintengine != 'native':
+            pylint_linter()
+        if cachepath:
+            worker_cache(cachepath)
+    WORKER_STATE['startup'] = time.perf_counter() - start
+
+
+def analyze_stuqs(arguments, lintengine='native', cachepath=None, skipped=(), rendering=None):
+    DETECTOR_TIMES.clear()
+    # the worker keeps its cache connection open, so it is not closed here
+    with nullcontext(worker_cache(cachepath) if cachepath else None) as cache:
+        orgsides = {}
+        sourcess = []
+        for args in arguments:
+            with TRACER.span('sources', 'submission', stuid=args[1], qid=args[2], cqid=args[3].parts[-3]):
+                sourcess.append(read_stuq_sources(*args, orgsides=orgsides, cache=cache, lintengine=lintengine, skipped=skipped))
+        pylintresults = None
+        if lintengine != 'native' and 'pylint' not in skipped:
+            start = time.perf_counter_ns()
+            with TRACER.span('pylint batch', 'lint', size=len(arguments)):
+                pylintresults = run_pylint_batch(code for args, (sources, orgside) in zip(arguments, sourcess)
+                                                 if sources and (cache is None or report_cache_key(sources, args[8], lintengine, args[12], skipped, pair_rendering(rendering, args[2])) not in cache)
+                                                 for code in ((sources[1][1],) if orgside['report'] is not None else (sources[0][1], sources[1][1])))
+            record_detector_time('pylint', 0, time.perf_counter_ns() - start)
+        results = []
+        for args, (sources, orgside) in zip(arguments, sourcess):
+            with TRACER.span('analyze_stuq', 'submission', stuid=args[1], qid=args[2], cqid=args[3].parts[-3]):
+                results.append(analyze_stuq(*args, sources=sources, pylintresults=pylintresults, lintengine=lintengine, cache=cache, skipped=skipped, orgside=orgside, rendering=rendering))
+    # plain dicts, so that the timings of a chunk can travel back from a pool worker
+    return results, {key: list(times) for key, times in DETECTOR_TIMES.items()}
+
+
+def analyze_indexed_stuqs(indexedarguments, lintengine='native', cachepath=None, skipped=(), rendering=None):
+    indices, arguments = zip(*indexedarguments)
+    results, times = analyze_stuqs(list(arguments), lintengine, cachepath, skipped, rendering)
+    # a worker reports its startup time along with its first chunk
+    return indices, results, times, WORKER_STATE.pop('startup', None), TRACER.drain()
+
+
+def stuq_cost(arguments):
+    examid, stuid, oqid, npcpath, pcpath, npopath, popath, reportworthy, vulturewl, examhome, npodata, npcdata, legitmax = arguments
+    if not reportworthy:
+        return 0
+
+    cost = 0
+    for path, data in (pick_source(popath, npopath, npodata), pick_source(pcpath, npcpath, npcdata)):
+        cost += len(data) if data is not None else path.stat().st_size
+    return cost
+
+
+def merge_detector_times(chunktimes):
+    times = {}
+    for chunk in chunktimes:
+        for key, (calls, elapsed) in chunk.items():
+            calls0, elapsed0 = times.get(key, (0, 0))
+            times[key] = (calls0 + calls, elapsed0 + elapsed)
+    return times
+
+
+def print_detector_times(times):
+    total = sum(elapsed for _, elapsed in times.values()) or 1
+    print(f"{'detector':<10}{'calls':>8}{'total ms':>12}{'us/call':>10}{'share':>8}")
+    for key, (calls, elapsed) in sorted(times.items(), key=lambda x: -x[1][1]):
+        print(f"{key:<10}{calls:>8}{elapsed / 1e6:>12.1f}{elapsed / 1e3 / max(calls, 1):>10.1f}{elapsed / total:>8.1%}")
+
+
+def legitrange_columns(qids, origqiddict):
+    legitranges = {qid: v['legitrange'] for qid, v in origqiddict.items() if 'legitrange' in v}
+    return qids.map({qid: r[0] for qid, r in legitranges.items()}), qids.map({qid: r[1] for qid, r in legitranges.items()})
+
+
+def ratio_legitrange(dist, length, legitmin, legitmax):
+    ratio = np.maximum(np.minimum(1 - dist / np.minimum(length, legitmax), (length - dist) / np.maximum(length, legitmin)), 0)
+    ratio = np.where(dist == 0, 1, ratio)
+    # pairs without a report have no distance and get no credit
+    return np.where(np.isnan(ratio), 0, ratio)
+
+
+def ratio_plain(dist, length, legitmin, legitmax):
+    return 1 - dist / length
+
+
+def grade_partial(gradeorg, gradecor, ratio):
+    return pd.concat([gradeorg, gradecor * ratio], axis=1).max(axis=1)
+
+
+def grade_full(gradeorg, gradecor, ratio):
+    return pd.concat([gradeorg, (gradecor == 100) * 100 * ratio], axis=1).max(axis=1)
+
+
+RATIO_POLICIES = {'legitrange': ratio_legitrange, 'plain': ratio_plain}
+GRADE_POLICIES = {'partial': grade_partial, 'full': grade_full}
+
+
+# works on whole columns as well as on the numbers of a single pair, see row_shown
+def calculate_ratio(policy, distance, orglines, corlines, dist, tokdist, toklen, legitmin, legitmax):
+    numlines = np.fmax(orglines, corlines)
+    if distance == 'tokens':
+        dist, length = tokdist, toklen
+        # legitrange is given in lines, so it is scaled by the pair's tokens per line
+        scale = length / numlines
+    else:
+        length, scale = numlines, 1
+    return RATIO_POLICIES[policy](dist, length, legitmin * scale, legitmax * scale)
+
+
+def score_ratio(reportdf, origqiddict, policy, distance='lines'):
+    legitmin, legitmax = legitrange_columns(reportdf['qid'], origqiddict)
+    columns = (reportdf[column].to_numpy(dtype=float) for column in ('org-#lines', 'cor-#lines', 'edit_dist', 'edit_tokdist', 'edit_toklen'))
+    return pd.Series(calculate_ratio(policy, distance, *columns, legitmin.to_numpy(dtype=float), legitmax.to_numpy(dtype=float)), index=reportdf.index)
+
+
+def score_grade(df, policy):
+    return GRADE_POLICIES[policy](df['grade-org'], df['grade-cor'], df['ratio'])
+
+
+def lsh_candidates(signatures):
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    pairs = set()
+    for band in range(MINHASH_BANDS):
+        keys = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows]).view(f'V{4 * rows}').ravel()
+        _, buckets = np.unique(keys, return_inverse=True)
+        # every member of a bucket is paired with the bucket's first member only, which keeps the candidates linear
+        # in the number of signatures, the clusters are closed over these pairs in find_copies
+        first = np.full(buckets.max() + 1, len(buckets))
+        np.minimum.at(first, buckets, np.arange(len(buckets)))
+        representatives = first[buckets]
+        members = np.flatnonzero(representatives != np.arange(len(buckets)))
+        pairs.update(zip(representatives[members].tolist(), members.tolist()))
+    return np.array(sorted(pairs), dtype=int).reshape(-1, 2)
+
+
+def union_find(count, pairs):
+    parents = list(range(count))
+
+    def root(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, j in pairs:
+        parents[root(i)] = root(j)
+    return [root(i) for i in range(count)]
+
+
+def find_copies(reportdf, threshold):
+    copies = pd.Series('', index=reportdf.index, dtype=object)
+    cluster = 0
+    for _, group in reportdf[reportdf['cor-minhash'].notna()].groupby('qid'):
+        corsignatures = minhash_matrix(group['cor-minhash'])
+        hasorg = group['org-minhash'].notna().to_numpy()
+        orgsignatures = minhash_matrix(group['org-minhash'].where(hasorg, '0' * 8 * MINHASH_PERMUTATIONS))
+        users = group['user'].to_numpy()
+
+        pairs = lsh_candidates(corsignatures)
+        i, j = pairs[:, 0], pairs[:, 1]
+        similarity = (corsignatures[i] == corsignatures[j]).mean(axis=1)
+        orgsimilarity = np.where(hasorg[i] & hasorg[j], (orgsignatures[i] == orgsignatures[j]).mean(axis=1), 0)
+        # similar corrections of similar originals are expected, a shared correction turns dissimilar originals into similar corrections
+        linked = (users[i] != users[j]) & (similarity >= threshold) & (orgsimilarity < threshold)
+
+        clusters = defaultdict(list)
+        for member, root in enumerate(union_find(len(group), pairs[linked])):
+            clusters[root].append(member)
+        for members in sorted(clusters.values()):
+            if len(members) > 1:
+                cluster += 1
+                copies[group.index[members]] = f"cluster {cluster} ({len(set(users[members]))} students)"
+    return copies
+
+
+EXCEL_HEADER_STYLE = {
+    'font': openpyxl.styles.Font(bold=True),
+    'border': openpyxl.styles.Border(*(openpyxl.styles.Side(style='thin'),) * 4),
+    'alignment': openpyxl.styles.Alignment(horizontal='center', vertical='top', shrinkToFit=True),
+    }
+EXCEL_CELL_STYLE = {'alignment': openpyxl.styles.Alignment(shrinkToFit=True)}
+
+
+def excel_cell(ws, value, style):
+    cell = openpyxl.cell.WriteOnlyCell(ws, None if value is None or (isinstance(value, float) and math.isnan(value)) else value)
+    for attribute, setting in style.items():
+        setattr(cell, attribute, setting)
+    return cell
+
 
+def excel_header_runs(labels):
+    start = 0
+    for i in range(1, len(labels) + 1):
+        if i == len(labels) or labels[i] != labels[start]:
+            yield start, i
+            start = i
 
-def format_excel(path, freezerows, freezecolumns):
-    wb = openpyxl.load_workbook(filename=path)
-    ws = wb.active
+
+def write_excel(path, df, freezerows, freezecolumns):
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet1')
     ws.freeze_panes = f"{openpyxl.utils.get_column_letter(freezecolumns + 1)}{freezerows + 1}"
-    for row in ws.iter_rows(1, ws.max_row, 1, ws.max_column):
-        for cell in row:
-            alignmentstyle = copy(cell.alignment)
-            alignmentstyle.shrinkToFit = True
-            cell.alignment = alignmentstyle
-    ws.auto_filter.ref = f"A{freezerows}:{openpyxl.utils.get_column_letter(ws.max_column)}{ws.max_row}"
+    width = df.index.nlevels + len(df.columns)
+    header = partial(excel_cell, ws, style=EXCEL_HEADER_STYLE)
+    body = partial(excel_cell, ws, style=EXCEL_CELL_STYLE)
+    headerrows = df.columns.nlevels
+
+    if df.columns.nlevels == 1:
+        ws.append([header(name) if name is not None else body(None) for name in df.index.names] + [header(c) for c in df.columns])
+    else:
+        for level in range(df.columns.nlevels):
+            prefixes = [c[:level + 1] for c in df.columns]
+            row = [header(df.columns.names[level])] + [None] * len(df.columns)
+            for start, stop in excel_header_runs(prefixes):
+                row[1 + start] = header(prefixes[start][-1])
+                if stop - start > 1:
+                    ws.merged_cells.add(f"{openpyxl.utils.get_column_letter(2 + start)}{level + 1}:{openpyxl.utils.get_column_letter(1 + stop)}{level + 1}")
+            ws.append(row)
+        if any(name is not None for name in df.index.names):
+            ws.append([header(name) for name in df.index.names] + [body(None)] * len(df.columns))
+            headerrows += 1
+
+    for values in df.itertuples(name=None):
+        index = values[0] if df.index.nlevels > 1 else (values[0],)
+        ws.append([header(i) for i in index] + [body(v) for v in values[1:]])
+
+    ws.auto_filter.ref = f"A{freezerows}:{openpyxl.utils.get_column_letter(width)}{headerrows + len(df)}"
     wb.save(path)
 
 
+def export_table(df, path, formats):
+    if not formats:
+        return
+    flatdf = df.copy()
+    if df.columns.nlevels > 1:
+        flatdf.columns = ['/'.join(str(label) for label in c if label != '') for c in df.columns]
+    for fmt in formats:
+        if fmt == 'csv':
+            flatdf.to_csv(path.with_suffix('.csv'))
+        else:
+            try:
+                flatdf.to_parquet(path.with_suffix('.parquet'))
+            except ImportError:
+                print(f"[parquet] skipped {path.with_suffix('.parquet').name}: pyarrow or fastparquet is not installed")
+
+
 def enlist(obj):
     return obj if type(obj) is list else [obj]
 
 
-if __name__ == '__main__':
-    CURRENT_EXAM = 3
-
-    coursehome = Path.home() / "Downloads/cmpe150fall2022"
-    have_legitrange = True
-    requires_full_grade_correction = False
-
-    if CURRENT_EXAM == 1:
-        examname = "mt1"
-        have_legitrange = False
-        origqiddict = {
-            'question1291': {'qnum': 'q1', 'corrid': 'question1291'},
-            'question1292': {'qnum': 'q1', 'corrid': 'question1292'},
-            'question1293': {'qnum': 'q2', 'corrid': 'question1293'},
-            'question1294': {'qnum': 'q2', 'corrid': 'question1294'},
-            'question1295': {'qnum': 'q3', 'corrid': 'question1295'},
-            'question1296': {'qnum': 'q3', 'corrid': 'question1296'}
-            }
-    elif CURRENT_EXAM == 2:
-        examname = "mt2"
-        origqiddict = {
-            'question1327': {'qnum': 'q1', 'corrid': 'question1336', 'legitrange': (6, 15)},
-            'question1328': {'qnum': 'q2', 'corrid': 'question1337', 'legitrange': (11, 25)},
-            'question1329': {'qnum': 'q3', 'corrid': 'question1338', 'legitrange': (8, 20)},
-            'question1330': {'qnum': 'q1', 'corrid': 'question1339', 'legitrange': (6, 15)},
-            'question1331': {'qnum': 'q2', 'corrid': 'question1340', 'legitrange': (11, 25)},
-            'question1332': {'qnum': 'q3', 'corrid': 'question1341', 'legitrange': (8, 20)}
-            }
-    elif CURRENT_EXAM == 3:
-        examname = "final"
-        requires_full_grade_correction = True
-        origqiddict = {
-            'question1369': {'qnum': 'q1', 'corrid': 'question1377', 'legitrange': (4, 10)},
-            'question1370': {'qnum': 'q2', 'corrid': 'question1378', 'legitrange': (8, 13)},
-            'question1371': {'qnum': 'q3', 'corrid': 'question1379', 'legitrange': (5, 12)},
-            'question1372': {'qnum': 'q4', 'corrid': ['question1380', 'question1384'], 'legitrange': (4, 12)},
-            'question1373': {'qnum': 'q1', 'corrid': 'question1381', 'legitrange': (6, 19)},
-            'question1374': {'qnum': 'q2', 'corrid': 'question1382', 'legitrange': (4, 9)},
-            'question1375': {'qnum': 'q3', 'corrid': 'question1383', 'legitrange': (5, 15)}
-            }
+def chunked_groups(groups, size):
+    chunk = []
+    for group in groups:
+        chunk.extend(group)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+WATCH_INTERVAL = 2
+
+
+def build_manifest(roots, home, previous=None):
+    manifest = {}
+    for root in roots:
+        for path in root.rglob('*'):
+            if path.name == 'backref.txt' or not path.is_file():
+                continue
+            stat = path.stat()
+            relpath = path.relative_to(home).as_posix()
+            if previous and (entry := previous.get(relpath)) and entry[:2] == [stat.st_mtime_ns, stat.st_size]:
+                manifest[relpath] = entry
+            else:
+                manifest[relpath] = [stat.st_mtime_ns, stat.st_size, hashlib.sha1(path.read_bytes()).hexdigest()]
+    return manifest
+
+
+def changed_paths(old, new):
+    return {relpath for relpath in old.keys() | new.keys() if (old.get(relpath) or [None])[-1] != (new.get(relpath) or [None])[-1]}
+
+
+def affected_stuqs(relpaths, corrqiddict):
+    def origid(qid):
+        return corrqiddict[qid]['origid'] if qid in corrqiddict else qid
+
+    stuqs = set()
+    qids = set()
+    for relpath in relpaths:
+        parts = relpath.split('/')
+        if parts[-1] == 'grade.txt':
+            continue
+        if parts[:2] == ['processed', 'questions'] and len(parts) > 3:
+            qids.add(parts[2])
+        elif parts[0] == 'processed' and len(parts) > 5:
+            stuqs.add((parts[3], origid(parts[4])))
+        elif parts[0] == 'patch' and len(parts) > 4:
+            stuqs.add((parts[2], origid(parts[3])))
+    return stuqs, qids
+
+
+def merge_results(results, newresults, stuqs):
+    fresh = {}
+    for result in newresults:
+        fresh.setdefault(result[:2], []).append(result)
+
+    merged = []
+    for result in results:
+        stuq = result[:2]
+        if stuq in stuqs:
+            merged += fresh.pop(stuq, [])
+        else:
+            merged.append(result)
+    return merged + [result for rows in fresh.values() for result in rows]
+
+
+EXAMS_CONFIG = Path(__file__).with_name("exams.json")
+STAGES = ('extract', 'whitelist', 'analyze', 'score', 'export')
+
+
+def load_exam(configpath, examname=None):
+    config = json.loads(Path(configpath).read_text())
+    examname = examname or config['current']
+    if examname not in config['exams']:
+        return None
+
+    exam = config['exams'][examname]
+    return {
+        'name': examname,
+        'coursehome': Path(config['course']).expanduser(),
+        'have_legitrange': exam.get('have_legitrange', True),
+        'requires_full_grade_correction': exam.get('requires_full_grade_correction', False),
+        'skipped_detectors': set(exam.get('skipped_detectors', ())),
+        'origqiddict': {qid: v | ({'legitrange': tuple(v['legitrange'])} if 'legitrange' in v else {}) for qid, v in exam['questions'].items()},
+        }
+
+
+@click.command()
+@click.option('--config', type=click.Path(exists=True, dir_okay=False, path_type=Path), default=EXAMS_CONFIG, show_default=True, help="JSON file with the course directory and the exam definitions.")
+@click.option('--exam', 'exam_name', help="Exam to evaluate, as named in the config; the config's current exam by default.")
+@click.option('--stage', 'stage_names', multiple=True, type=click.Choice(STAGES), help="Run only this stage, reusing the checkpoints of the others; repeat for several. Stages whose checkpoint is missing run as well.")
+@click.option('--native', 'lintengine', flag_value='native', default=True, help="Check W0104/W0105 with the built-in AST checker.")
+@click.option('--pylint', 'lintengine', flag_value='pylint', help="Check W0104/W0105 with pylint.")
+@click.option('--pylint-compat', 'lintengine', flag_value='compat', help="Run both checkers, report their differences and keep pylint's results.")
+@click.option('--no-cache', is_flag=True, help="Recompute every report instead of reusing the ones cached from earlier runs.")
+@click.option('--cache-size', default=REPORT_CACHE_MAX_MB, show_default=True, help="Size limit of the report cache in MB.")
+@click.option('--incremental', is_flag=True, help="Re-analyze only the student/question pairs whose files changed since the last run.")
+@click.option('--watch', is_flag=True, help="Keep running and refresh the reports whenever the patch or processed files change.")
+@click.option('--stream', is_flag=True, help="Read the submissions straight out of the raw tarballs instead of extracting them; only files that get a patch copy are written to disk.")
+@click.option('--member', 'members', multiple=True, default=TAR_MEMBERS, show_default=True, help="Archive members to extract, matched against the end of the member path; repeat for several.")
+@click.option('--ratio-distance', type=click.Choice(['lines', 'tokens']), default='lines', show_default=True, help="Distance the correction ratio is computed from: line or token edits.")
+@click.option('--skip-detector', 'skip_detectors', multiple=True, type=click.Choice([key for key, detector in DETECTORS.items() if detector['flawless'] is not None]), help="Detector to leave out of the reports, on top of the ones the exam config skips; repeat for several.")
+@click.option('--detector-times', is_flag=True, help="Print how much time each detector took, summed over all workers.")
+@click.option('--render-below', default=1.0, show_default=True, help="Write the edit opcodes only for rows with flaws or with a ratio below this.")
+@click.option('--copy-threshold', default=0.8, show_default=True, help="Estimated token-shingle similarity above which two students' corrections of the same question are listed as copies, unless their originals are that similar too.")
+@click.option('--export', 'exports', multiple=True, type=click.Choice(['csv', 'parquet']), help="Also write the corrections and full reports in this format next to the Excel files; repeat for several.")
+@click.option('--trace', type=click.Path(dir_okay=False, path_type=Path), help="Write a Chrome trace (chrome://tracing, Perfetto) of the run's stages and submissions to this file and print the slowest submissions.")
+@click.option('--html-diff', nargs=2, metavar='USER QID', help="Only write a side-by-side HTML diff of the original and the correction(s) of one user's question, e.g. user1001 question1374.")
+def main(config, exam_name, stage_names, lintengine, no_cache, cache_size, incremental, watch, stream, members, ratio_distance, skip_detectors, detector_times, render_below, copy_threshold, exports, trace, html_diff):
+    exam = load_exam(config, exam_name)
+    if exam is None:
+        print(f"No exam {exam_name} in {config}")
+        return
+
+    coursehome = exam['coursehome']
+    examname = exam['name']
+    have_legitrange = exam['have_legitrange']
+    requires_full_grade_correction = exam['requires_full_grade_correction']
+    skipped_detectors = exam['skipped_detectors']
+    origqiddict = exam['origqiddict']
 
     corrqiddict = {cqid : {'qnum': v['qnum'], 'origid': oqid} for oqid, v in origqiddict.items() for cqid in enlist(v['corrid'])}
 
+    ratiopolicy = 'legitrange' if have_legitrange else 'plain'
+    skipped = tuple(sorted(skipped_detectors | set(skip_detectors)))
+    reportcolumns = report_columns(skipped)
+    gradepolicy = 'full' if requires_full_grade_correction else 'partial'
+
     examhome = coursehome / examname
 
     rawhome = examhome / "raw"
@@ -624,62 +1680,172 @@ if __name__ == '__main__':
     raworiginalshome = rawhome / "originals"
     rawcorrectionshome = rawhome / "corrections"
 
-    rawquestiontars = rawquestionshome.glob("*.tar.gz")
-    raworiginaltars = raworiginalshome.glob("*.tar.gz")
-    rawcorrectiontars = rawcorrectionshome.glob("*/*.tar.gz")
+    rawquestiontars = sorted(rawquestionshome.glob("*.tar.gz"))
+    raworiginaltars = sorted(raworiginalshome.glob("*.tar.gz"))
+    rawcorrectiontars = sorted(rawcorrectionshome.glob("*/*.tar.gz"))
 
     processedhome = examhome / "processed"
     processedquestionsdir = processedhome / "questions"
     processedoriginalsdir = processedhome / "originals"
     processedcorrectionsdir = processedhome / "corrections"
+    tarmanifestsdir = examhome / "tarmanifests"
+    gradebookcachedir = examhome / "gradebooks"
 
     patchhome = examhome / "patch"
     patchoriginalsdir = patchhome / "originals"
     patchcorrectionsdir = patchhome / "corrections"
 
 
+    # the state doubles as the checkpoint of the analyze stage
+    statepath = examhome / f'state_{examname}.pkl'
+    manifestpath = examhome / f'manifest_{examname}.json'
+    manifestroots = [processedhome, patchhome]
+    checkpointsdir = examhome / "checkpoints"
+    whitelistspath = checkpointsdir / f'whitelists_{examname}.pkl'
+    scorespath = checkpointsdir / f'scores_{examname}.pkl'
+    TRACER.enabled = trace is not None
+
+
+    def extracted(kinds=('questions', 'originals', 'corrections')):
+        tars = {'questions': (rawquestiontars, processedquestionsdir), 'originals': (raworiginaltars, processedoriginalsdir), 'corrections': (rawcorrectiontars, processedcorrectionsdir)}
+        return all(tarsextracted(tars[kind][0], tars[kind][1], tarmanifestsdir / kind, members) for kind in kinds)
+
+
+    # the scores are only current for the state that they were computed from
+    def state_identity():
+        if not statepath.is_file():
+            return None
+        stat = statepath.stat()
+        return [stat.st_mtime_ns, stat.st_size]
+
+
+    def read_scores():
+        scores = pd.read_pickle(scorespath) if scorespath.is_file() else None
+        return scores['tables'] if isinstance(scores, dict) and scores['state'] == state_identity() else None
+
+
+    def patchpath(patchdir, stuid, qid):
+        return patchdir / stuid / qid / "src/Main.py"
+
+
+    def write_html_diffs(stuid, oqid):
+        # only the student's own files are read, straight from the tars when they are not extracted
+        sourcedata = {}
+        if stream or not extracted(('originals', 'corrections')):
+            sourcedata |= tarsread(raworiginaltars, processedoriginalsdir, f"*/{stuid}/*/src/Main.py")
+            sourcedata |= tarsread(rawcorrectiontars, processedcorrectionsdir, f"*/{stuid}/*/src/Main.py")
+
+        def find(root, qid):
+            pattern = f"*/{stuid}/{qid}/src/Main.py"
+            paths = [path for path in sourcedata if path.is_relative_to(root) and path.match(pattern)] if sourcedata else root.glob(pattern)
+            return min(paths, default=None)
+
+        npopath = find(processedoriginalsdir, oqid) if oqid in origqiddict else None
+        if npopath is None:
+            print(f"[{stuid}-{oqid}] no original submission found")
+            return
+
+        opath, odata = pick_source(patchpath(patchoriginalsdir, stuid, oqid), npopath, sourcedata.get(npopath))
+        for cqid in enlist(origqiddict[oqid]['corrid']):
+            if (npcpath := find(processedcorrectionsdir, cqid)) is not None:
+                cpath, cdata = pick_source(patchpath(patchcorrectionsdir, stuid, cqid), npcpath, sourcedata.get(npcpath))
+                if sources := read_sources(opath, cpath, orgdata=odata, cordata=cdata):
+                    diffpath = examhome / 'diffs' / f'{stuid}-{oqid}-{cqid}.html'
+                    write_html_diff(diffpath, sources[0][0], sources[1][0], str(opath.relative_to(examhome)), str(cpath.relative_to(examhome)))
+                    print(f"[{stuid}-{oqid}] wrote {diffpath.relative_to(examhome)}")
+
+
+    # the diff is an on-demand lookup of one pair, so none of the stages run for it
+    if html_diff:
+        write_html_diffs(*html_diff)
+        return
+
+    stages = set(stage_names or STAGES)
+    if incremental or watch:
+        stages |= {'analyze', 'score', 'export'}
+
+    state = None
+    if (incremental or watch or 'analyze' not in stages) and statepath.is_file() and manifestpath.is_file():
+        state = pd.read_pickle(statepath)
+        with open(manifestpath) as mf:
+            manifest = json.load(mf)
+        if state.get('columns') != reportcolumns:
+            print("The earlier run has different report columns, analyzing everything.")
+            state = None
+    elif incremental or watch:
+        print("No earlier run to continue from, analyzing everything.")
+
+    # a stage that is not asked for still runs when a later one needs its missing checkpoint
+    scores = read_scores() if 'export' in stages and 'score' not in stages else None
+    if 'export' in stages and scores is None:
+        stages.add('score')
+    if 'score' in stages and state is None:
+        stages.add('analyze')
+    if 'analyze' in stages and not whitelistspath.is_file():
+        stages.add('whitelist')
+    if stages & {'whitelist', 'analyze'} and not stream and 'extract' not in stages and not extracted():
+        stages.add('extract')
+    if stage_names:
+        print(f"[stages] running {', '.join(stage for stage in STAGES if stage in stages)}")
+
     # EXTRACT TARS
-    tarsextract(rawquestiontars, processedquestionsdir)
-    tarsextract(raworiginaltars, processedoriginalsdir)
-    tarsextract(rawcorrectiontars, processedcorrectionsdir)
+    sourcedata = {}
+    if stream and stages & {'whitelist', 'analyze'}:
+        with TRACER.span('extract', stream=stream):
+            sourcedata |= tarsread(rawquestiontars, processedquestionsdir, "*/src/Main.py")
+            sourcedata |= tarsread(raworiginaltars, processedoriginalsdir, "*/*/*/src/Main.py")
+            sourcedata |= tarsread(rawcorrectiontars, processedcorrectionsdir, "*/*/*/src/Main.py")
+    elif 'extract' in stages and not stream:
+        with TRACER.span('extract', stream=stream):
+            tarsextract(rawquestiontars, processedquestionsdir, tarmanifestsdir / "questions", members)
+            tarsextract(raworiginaltars, processedoriginalsdir, tarmanifestsdir / "originals", members)
+            tarsextract(rawcorrectiontars, processedcorrectionsdir, tarmanifestsdir / "corrections", members)
+
+
+    def globsources(root, pattern):
+        if stream:
+            return [path for path in sourcedata if path.is_relative_to(root) and len(path.relative_to(root).parts) == len(Path(pattern).parts) and path.match(pattern)]
+        return list(root.glob(pattern))
+
 
     # PREPARE VULTURE WHITELISTS
-    vulturewldict = {qdir.name : prepare_vulture_whitelist(qdir / 'src/Main.py') for qdir in processedquestionsdir.iterdir()}
+    if 'whitelist' in stages:
+        with TRACER.span('whitelists'):
+            vulturewldict = {qpath.parts[-3] : prepare_vulture_whitelist(qpath, sourcedata.get(qpath)) for qpath in globsources(processedquestionsdir, "*/src/Main.py")}
+        checkpointsdir.mkdir(parents=True, exist_ok=True)
+        pd.to_pickle(vulturewldict, whitelistspath)
+    else:
+        vulturewldict = pd.read_pickle(whitelistspath) if 'analyze' in stages else {}
 
     # PREPARE POINTERS TO CORRECTIONS
     correctiondict = mergedeep.merge({}, *({ cpath.parts[-4] : { cpath.parts[-3] : { 'path': cpath, 'section': cpath.parts[-5].split('_')[1] } } }
-                                            for cpath in processedcorrectionsdir.glob("*/*/*/src/Main.py")))
-
-    # COLLECT ORIGINAL GRADES
-    originalgradebooks = raworiginalshome.glob("*.xlsx")
-    originaldf = pd.DataFrame(chain(*(collect_gradebook(gb, 'org') for gb in originalgradebooks))).set_index(['user', 'qid']).sort_index()
-    for pogpath in patchoriginalsdir.glob("*/*/src/grade.txt"):
-        with open(pogpath) as pogf:
-            originaldf.loc[(pogpath.parts[-4], pogpath.parts[-3]), 'grade-org'] = float(pogf.readline())
-
-    # COLLECT CORRECTION GRADES
-    correctiongradebooks = rawcorrectionshome.glob("*/*.xlsx")
-    correctiondf = pd.DataFrame(chain(*(collect_gradebook(gb, 'cor') for gb in correctiongradebooks)))
-    correctiondf['qid'] = correctiondf['qid'].apply(lambda x: corrqiddict[x]['origid'])
-    correctiondf = correctiondf.set_index(['user', 'qid']).sort_index()
-    for pcgpath in patchcorrectionsdir.glob("*/*/src/grade.txt"):
-        with open(pcgpath) as pcgf:
-            correctiondf.loc[(pcgpath.parts[-4], corrqiddict[pcgpath.parts[-3]]['origid']), 'grade-cor'] = float(pcgf.readline())
-    correctiondf = correctiondf.sort_values('grade-cor', ascending=False).groupby(['user', 'qid']).first().sort_index()
+                                            for cpath in globsources(processedcorrectionsdir, "*/*/*/src/Main.py")))
+
+    if state is None and 'analyze' in stages:
+        with TRACER.span('gradebooks'):
+            # COLLECT ORIGINAL GRADES
+            originalgradebooks = raworiginalshome.glob("*.xlsx")
+            originalgbdf = pd.concat([collect_gradebook(gb, 'org', gradebookcachedir / "originals") for gb in originalgradebooks], ignore_index=True).set_index(['user', 'qid']).sort_index()
+
+            # COLLECT CORRECTION GRADES
+            correctiongradebooks = rawcorrectionshome.glob("*/*.xlsx")
+            correctiongbdf = pd.concat([collect_gradebook(gb, 'cor', gradebookcachedir / "corrections") for gb in correctiongradebooks], ignore_index=True)
+            correctiongbdf['qid'] = correctiongbdf['qid'].map({cqid: v['origid'] for cqid, v in corrqiddict.items()})
+            correctiongbdf = correctiongbdf.set_index(['user', 'qid']).sort_index()
+    elif state is not None:
+        originalgbdf, correctiongbdf = state['originalgbdf'], state['correctiongbdf']
 
     # COLLECT STUDENT INFO
-    studentinfodf = pd.read_excel(coursehome / 'studentinfo.xlsx')
-    studentinfodf['user'] = ['user' + str(x) for x in studentinfodf['user']]
-    studentinfodf = studentinfodf.set_index('user')
-    studentinfodf.columns = pd.MultiIndex.from_product([['INFO'], studentinfodf.columns])
+    if 'score' in stages:
+        with TRACER.span('student info'):
+            studentinfodf = pd.read_excel(coursehome / 'studentinfo.xlsx')
+            studentinfodf['user'] = ['user' + str(x) for x in studentinfodf['user']]
+            studentinfodf = studentinfodf.set_index('user')
+            studentinfodf.columns = pd.MultiIndex.from_product([['INFO'], studentinfodf.columns])
 
     # PREPARE REPORT
 
-    opaths = list(processedoriginalsdir.glob("*/*/*/src/Main.py"))
-
-
-    def patchpath(patchdir, stuid, qid):
-        return patchdir / stuid / qid / "src/Main.py"
+    opaths = globsources(processedoriginalsdir, "*/*/*/src/Main.py")
 
 
     def handle_patches(patchdir, stuid, qid, nppath):
@@ -690,14 +1856,15 @@ if __name__ == '__main__':
         return ppath
 
 
-    def produce_arguments():
-        for npopath in (bar := alive_it(opaths)):
+    def produce_arguments(stuqs):
+        for npopath in opaths:
             examid = npopath.parts[-5].split('_')[1]
             stuid = npopath.parts[-4]
             oqid = npopath.parts[-3]
             cqids = origqiddict[oqid]['corrid']
 
-            bar.title(f'on {stuid}-{oqid}')
+            if stuqs is not None and (stuid, oqid) not in stuqs:
+                continue
 
             for cqid in enlist(cqids):
                 if cqid in correctiondict[stuid]:
@@ -707,53 +1874,200 @@ if __name__ == '__main__':
 
                     reportworthy = True # (stuid, oqid) in correctiondf.index and correctiondf.loc[(stuid, oqid), 'grade-cor'].item() > 0
 
-                    yield examid, stuid, oqid, npcpath, pcpath, npopath, popath, reportworthy, vulturewldict[oqid], examhome
-
-
-    with Pool() as pool:
-        # arguments = list(produce_arguments())
-        # results = pool.starmap(analyze_stuq, tqdm(arguments))
-        results = pool.starmap(analyze_stuq, produce_arguments())
-        reportdf = pd.DataFrame(results)
-
-    if have_legitrange:
-        reportdf['ratio'] = reportdf.apply(lambda r: 1 if r['edit_dist'] == 0 else max(0, min(
-            1 - r['edit_dist'] / min(max(r['org-#lines'], r['cor-#lines']), origqiddict[r['qid']]['legitrange'][1]),
-            (max(r['org-#lines'], r['cor-#lines']) - r['edit_dist']) / max(r['org-#lines'], r['cor-#lines'], origqiddict[r['qid']]['legitrange'][0])
-            )), axis=1)
-        # reportdf['ratio'] = np.where(reportdf['edit_dist'] == 0, 1, pd.concat((1 - reportdf['edit_dist'] / reportdf[['org-#lines', 'cor-#lines']].assign(legitmax=.max(axis=1))
-    else:
-        reportdf['ratio'] = 1 - reportdf['edit_dist'] / reportdf[['org-#lines', 'cor-#lines']].max(axis=1)
-
-    for pf in ('org', 'cor'):
-        reportdf[f'{pf}-inspect'] = reportdf[[c for c in reportdf.columns if c.startswith(pf)]].apply(get_flaws, axis=1)
-    reportdf['all-inspect'] = reportdf.apply(get_flaws, axis=1)
-
-    reportcorrectionspath = examhome / f'report_corrections_{examname}.xlsx'
-    reportdf[( c for c in reportdf.columns if c not in ['qid', 'sect', 'exam'] and (c not in flawless or (reportdf[c] != flawless[c]).any()) )].to_excel(reportcorrectionspath)
-    format_excel(reportcorrectionspath, 1, 1)
-
-    # reportdf.pivot(index="user", columns="qnum").swaplevel(0, 1, axis=1).sort_index(1)['q2']
-
-    df = originaldf.join(correctiondf).join(reportdf.set_index(['user', 'qid'])).reset_index(1)
-    df['qnum'] = df['qid'].apply(lambda x: origqiddict[x]['qnum'])
-    if requires_full_grade_correction:
-        df['grade-new'] = pd.concat([df['grade-org'], (df['grade-cor'] == 100) * 100 * df['ratio']], axis=1).max(axis=1)
+                    yield examid, stuid, oqid, npcpath, pcpath, npopath, popath, reportworthy, vulturewldict[oqid], examhome, sourcedata.get(npopath), sourcedata.get(npcpath), \
+                          origqiddict[oqid]['legitrange'][1] if have_legitrange else None
+
+
+    # the compatibility check has to see every report computed afresh
+    cachepath = None if no_cache or lintengine == 'compat' else examhome / 'report_cache.sqlite3'
+    rendering = {'below': render_below, 'policy': ratiopolicy, 'distance': ratio_distance,
+                 'legitranges': {oqid: v.get('legitrange') for oqid, v in origqiddict.items()}}
+
+
+    def analyze(stuqs=None):
+        arguments = list(produce_arguments(stuqs))
+        # the corrections of one original stay together so that a single worker analyzes the original once for all of them,
+        # and the most expensive groups go first so that long pylint runs do not bunch up at the tail
+        groups = defaultdict(list)
+        for i, args in enumerate(arguments):
+            groups[args[1], args[2]].append(i)
+        order = sorted(groups.values(), key=lambda group: -sum(stuq_cost(arguments[i]) for i in group))
+        batchsize = max(1, min(PYLINT_BATCH_SIZE, math.ceil(len(arguments) / (cpu_count() * TASKS_PER_WORKER))))
+
+        results = [None] * len(arguments)
+        chunktimes = []
+        startups = []
+        with TRACER.span('analyze', pairs=len(arguments)), Pool(initializer=init_worker, initargs=(lintengine, cachepath, TRACER.enabled, detector_times)) as pool, alive_bar(len(arguments)) as bar:
+            for indices, chunkresults, times, startup, events in pool.imap_unordered(partial(analyze_indexed_stuqs, lintengine=lintengine, cachepath=cachepath, skipped=skipped, rendering=rendering),
+                                                                    chunked_groups(([(i, arguments[i]) for i in group] for group in order), batchsize)):
+                for i, result in zip(indices, chunkresults):
+                    results[i] = result
+                chunktimes.append(times)
+                TRACER.extend(events)
+                if startup is not None:
+                    startups.append(startup)
+                bar.title(f'on {chunkresults[-1][0]}-{chunkresults[-1][1]}')
+                bar(len(chunkresults))
+
+        if detector_times:
+            if startups:
+                print(f"[workers] {len(startups)} started, {max(startups):.2f}s at most and {sum(startups):.2f}s in total")
+            print_detector_times(merge_detector_times(chunktimes))
+
+        if cachepath:
+            with ReportCache(cachepath) as cache:
+                cache.evict(cache_size * 2**20)
+
+        return results
+
+
+    # the workers leave out the diffs of the rows that only a copy flag or a higher --render-below than the analysis had brings up
+    def fill_opcodes(reportdf, results):
+        opcodes = reportdf['edit_opcodes'].tolist()
+        missing = shown_rows(reportdf, render_below) & reportdf['edit_opcodes'].isna().to_numpy() & reportdf['edit_dist'].notna().to_numpy()
+        orgcolumn, corcolumn = reportcolumns.index('org'), reportcolumns.index('cor')
+        for i in np.flatnonzero(missing):
+            opath, cpath = examhome / results[i][orgcolumn], examhome / results[i][corcolumn]
+            if (opath.is_file() or opath in sourcedata) and (cpath.is_file() or cpath in sourcedata):
+                if sources := read_sources(opath, cpath, orgdata=sourcedata.get(opath), cordata=sourcedata.get(cpath)):
+                    opcodes[i] = calculate_edit_opcodes(sources[0][0], sources[1][0], reportdf['edit_dist'].iloc[i])['edit_opcodes']
+        return opcodes
+
+
+    @TRACER.span('score')
+    def score_reports(results):
+        originaldf = override_grades(originalgbdf, 'grade-org', {(pogpath.parts[-4], pogpath.parts[-3]): read_grade(pogpath)
+                                                                 for pogpath in patchoriginalsdir.glob("*/*/src/grade.txt")})
+        correctiondf = override_grades(correctiongbdf, 'grade-cor', {(pcgpath.parts[-4], corrqiddict[pcgpath.parts[-3]]['origid']): read_grade(pcgpath)
+                                                                    for pcgpath in patchcorrectionsdir.glob("*/*/src/grade.txt")})
+        correctiondf = correctiondf.sort_values('grade-cor', ascending=False).groupby(['user', 'qid']).first().sort_index()
+
+        with TRACER.span('scoring'):
+            reportdf = records_frame(results, reportcolumns)
+
+            reportdf['ratio'] = score_ratio(reportdf, origqiddict, ratiopolicy, ratio_distance)
+            with TRACER.span('copies'):
+                reportdf['cor-copies'] = find_copies(reportdf, copy_threshold)
+            reportdf = reportdf.drop(columns=['org-minhash', 'cor-minhash'])
+
+            for pf in ('org', 'cor'):
+                reportdf[f'{pf}-inspect'] = get_flaws_column(reportdf, pf)
+            reportdf['all-inspect'] = get_flaws_column(reportdf)
+            reportdf['edit_opcodes'] = fill_opcodes(reportdf, results)
+            reportdf['edit_opcodes'] = render_opcodes_column(reportdf, render_below)
+            if have_legitrange:
+                reportdf['edit_dist'] = mark_banded_distances(reportdf, origqiddict)
+
+        correctionsdf = reportdf[[c for c in reportdf.columns if c not in ['qid', 'sect', 'exam'] and (c not in flawless or (reportdf[c] != flawless[c]).any())]]
+
+        # reportdf.pivot(index="user", columns="qnum").swaplevel(0, 1, axis=1).sort_index(1)['q2']
+
+        df = originaldf.join(correctiondf).join(reportdf.set_index(['user', 'qid'])).reset_index(1)
+        df['qnum'] = df['qid'].map({qid: v['qnum'] for qid, v in origqiddict.items()})
+        df['grade-new'] = score_grade(df, gradepolicy)
+
+        # gets rid of duplicate corrections when multiple correction projects are provided for the same exam project
+        df = df.reset_index().sort_values('grade-new', ascending=False).drop_duplicates(['user', 'qid']).set_index('user')
+
+        qnums = df['qnum'].unique()
+        df = df.pivot(columns='qnum').swaplevel(0, 1, axis=1).sort_index(axis=1)
+        df[('TOTAL', 'ORIGINAL')] = pd.concat((df[(qnum, 'grade-org')] for qnum in qnums), axis=1).mean(axis=1)
+        df[('TOTAL', 'NEW')] = pd.concat((df[(qnum, 'grade-new')] for qnum in qnums), axis=1).mean(axis=1)
+        df[('TOTAL', 'DELTA')] = df[('TOTAL', 'NEW')] - df[('TOTAL', 'ORIGINAL')]
+        # df[('INFO', 'STUDENT ID')] = [studentinfodf.loc[user, 'studeintID'] if user in studentinfodf.index else 'MISSING' for user in df.index]
+        df = df.join(studentinfodf)
+        return correctionsdf, df
+
+
+    @TRACER.span('export')
+    def export_reports(correctionsdf, df):
+        reportcorrectionspath = examhome / f'report_corrections_{examname}.xlsx'
+        with TRACER.span('excel', path=reportcorrectionspath.name):
+            write_excel(reportcorrectionspath, correctionsdf, 1, 1)
+            export_table(correctionsdf, reportcorrectionspath, exports)
+
+        reportfullpath = examhome / f'report_full_{examname}.xlsx'
+        with TRACER.span('excel', path=reportfullpath.name):
+            write_excel(reportfullpath, df, 3, 1)
+            export_table(df, reportfullpath, exports)
+
+
+    def write_reports(results):
+        if 'score' in stages:
+            tables = score_reports(results)
+            checkpointsdir.mkdir(parents=True, exist_ok=True)
+            pd.to_pickle({'state': state_identity(), 'tables': tables}, scorespath)
+        elif 'export' in stages:
+            tables = scores
+        if 'export' in stages:
+            export_reports(*tables)
+
+
+    @TRACER.span('save state')
+    def save_state(results, manifest):
+        pd.to_pickle({'columns': reportcolumns, 'results': results, 'originalgbdf': originalgbdf, 'correctiongbdf': correctiongbdf}, statepath)
+        with open(manifestpath, 'w') as mf:
+            json.dump(manifest, mf)
+
+
+    def refresh(results, manifest):
+        newmanifest = build_manifest(manifestroots, examhome, manifest)
+        changed = changed_paths(manifest, newmanifest)
+        stuqs, qids = affected_stuqs(changed, corrqiddict)
+        stuqs |= {(stuid, oqid) for stuid, oqid in (npopath.parts[-4:-2] for npopath in opaths) if oqid in qids}
+        if qids:
+            # the pairs of a changed question are checked against its new whitelist
+            with TRACER.span('whitelists', qids=len(qids)):
+                for qid in qids:
+                    qpath = processedquestionsdir / qid / "src/Main.py"
+                    if qpath.is_file():
+                        vulturewldict[qid] = prepare_vulture_whitelist(qpath, sourcedata.get(qpath))
+            checkpointsdir.mkdir(parents=True, exist_ok=True)
+            pd.to_pickle(vulturewldict, whitelistspath)
+        if stuqs:
+            print(f"Re-analyzing {len(stuqs)} student/question pair(s): {', '.join('-'.join(stuq) for stuq in sorted(stuqs))}")
+            results = merge_results(results, analyze(stuqs), stuqs)
+        if changed:
+            manifest = build_manifest(manifestroots, examhome, newmanifest)
+            save_state(results, manifest)
+            write_reports(results)
+        return results, manifest
+
+
+    def flush_trace():
+        # every refresh that did some work gets a trace of its own
+        if trace and TRACER:
+            events = TRACER.drain()
+            write_trace(trace, events)
+            print_slowest_submissions(events)
+            print(f"[trace] wrote {len(events)} events to {trace}")
+
+
+    if 'analyze' not in stages:
+        if stages & {'score', 'export'}:
+            write_reports(state['results'] if state is not None else None)
+    elif state is None:
+        results = analyze()
+        if not results and tarsread(raworiginaltars, processedoriginalsdir, "*/*/*/src/Main.py"):
+            print("[analyze] found no student/question pairs although the original tars hold submissions, "
+                  "keeping the earlier state and reports; run the extract stage to restore the processed tree")
+            return
+        manifest = build_manifest(manifestroots, examhome)
+        save_state(results, manifest)
+        write_reports(results)
     else:
-        df['grade-new'] = pd.concat([df['grade-org'], df['grade-cor'] * df['ratio']], axis=1).max(axis=1)
-
-    # gets rid of duplicate corrections when multiple correction projects are provided for the same exam project
-    df = df.reset_index().sort_values('grade-new', ascending=False).drop_duplicates(['user', 'qid']).set_index('user')
+        results, manifest = refresh(state['results'], manifest)
+    flush_trace()
 
-    qnums = df['qnum'].unique()
-    df = df.pivot(columns='qnum').swaplevel(0, 1, axis=1).sort_index(axis=1)
-    df[('TOTAL', 'ORIGINAL')] = pd.concat((df[(qnum, 'grade-org')] for qnum in qnums), axis=1).mean(axis=1)
-    df[('TOTAL', 'NEW')] = pd.concat((df[(qnum, 'grade-new')] for qnum in qnums), axis=1).mean(axis=1)
-    df[('TOTAL', 'DELTA')] = df[('TOTAL', 'NEW')] - df[('TOTAL', 'ORIGINAL')]
-    # df[('INFO', 'STUDENT ID')] = [studentinfodf.loc[user, 'studeintID'] if user in studentinfodf.index else 'MISSING' for user in df.index]
-    df = df.join(studentinfodf)
-
-    reportfullpath = examhome / f'report_full_{examname}.xlsx'
-    df.to_excel(reportfullpath)
+    while watch:
+        try:
+            time.sleep(WATCH_INTERVAL)
+            results, manifest = refresh(results, manifest)
+            flush_trace()
+        except PermissionError as e:
+            print(f"Could not update the reports, will retry on the next change: {e}")
+        except KeyboardInterrupt:
+            break
 
-    format_excel(reportfullpath, 3, 1)
+if __name__ == '__main__':
+    main()